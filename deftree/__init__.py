@@ -8,26 +8,100 @@
 
     3. Attribute represent a name value pair
 """
+import marshal
+import os
+from codecs import escape_decode
+from contextlib import contextmanager
+from hashlib import sha256
 from re import compile as re_compile
-from sys import stdout
-from typing import Iterator, Union
+from sys import intern, stdout
+from threading import RLock, get_ident
+from time import perf_counter
+from typing import Iterable, Iterator, Optional, Union
+from weakref import ref
 
 __version__ = "2.1.4"
-__all__ = ["DefTree", "to_string", "parse", "dump", "validate", "is_attribute", "is_element", "from_string"]
+__all__ = ["DefTree", "ParseCache", "Difference", "to_string", "to_stream", "parse", "parse_many", "iterparse", "dump",
+           "validate", "compare", "compare_many", "stats", "Stats", "is_attribute", "is_element", "from_string"]
 
 
 class ParseError(SyntaxError):
     pass
 
 
+class _EscapeTable(dict):
+    """Translation table escaping text the way Defold escapes a document embedded in a data attribute. Every level
+    of embedding escapes the text again, as the escapes are per character the escapes of all levels are combined
+    in the table for a depth so a document is escaped in one pass however deep it is embedded"""
+    escapes = {"\\": "\\\\", '"': '\\"', "'": "\\'", "\n": "\\n", "\r": "\\r", "\t": "\\t", "\a": "\\a",
+               "\b": "\\b", "\f": "\\f", "\v": "\\v"}
+    _special_regex = re_compile(r'[^\x20-\x7e\n]')
+    _tables = dict()
+
+    def __init__(self, depth):
+        super(_EscapeTable, self).__init__()
+        self.depth = depth
+        # Printable ascii text only needs these escaped, which str.replace does faster than a translation
+        self._common = tuple(self[ord(character)] for character in "\\\"'\n") if depth else None
+
+    @classmethod
+    def for_depth(cls, depth):
+        """Returns the table for a document embedded depth levels down"""
+        table = cls._tables.get(depth)
+        if table is None:
+            table = cls._tables.setdefault(depth, cls(depth))
+        return table
+
+    def __missing__(self, key):
+        if not self.depth:
+            raise LookupError(key)
+        character = chr(key)
+        if character in self.escapes:
+            text = self.escapes[character]
+        elif 0x20 <= key < 0x7f:
+            text = character
+        else:
+            text = "".join("\\{:03o}".format(b) for b in character.encode("utf-8", "surrogateescape"))
+        text = text.translate(self.for_depth(self.depth - 1))
+        self[key] = text
+        return text
+
+    def escape(self, text):
+        """Returns text escaped for the depth of the table"""
+        if not self.depth:
+            return text
+        backslash, quote, apostrophe, newline = self._common
+        text = text.replace("\\", backslash).replace('"', quote).replace("'", apostrophe).replace("\n", newline)
+        if self._special_regex.search(text):
+            text = self._special_regex.sub(self._escape_match, text)
+        return text
+
+    def _escape_match(self, match):
+        return self[ord(match.group())]
+
+
 class _DefParser:
     _pattern = r'(?:data:)|(?:^|\s)(\w+):\s+(.+(?:\s+".*)*)|(\w*)\W{|(})'
     _regex = re_compile(_pattern)
-
-    def __init__(self, root_element):
+    # Documents given as bytes are tokenized as they are and only the values that are read are decoded
+    _bytes_regex = re_compile(_pattern.encode("ascii"))
+    _carriage_return_regex = re_compile(b"\r")
+    _non_space_regex = re_compile(r'\S')
+    _bytes_non_space_regex = re_compile(rb'\S')
+    _split = '"\n  "'
+    # Runs of attributes are written in chunks of at most this many lines
+    _lines_per_chunk = 1024
+
+    def __init__(self, root_element, lazy_data=True, lazy_types=True):
         self.file_path = None
+        self.source_state = None
+        self.lazy_data = lazy_data
+        self.lazy_types = lazy_types
         self.root = root_element
         self._element_chain = [self.root]
+        self._events = None
+        self._event_filter = frozenset()
+        self._names = dict()
 
     def parse(self, source) -> 'Element':
         """Loads an external Defold section into this DefTree
@@ -35,154 +109,427 @@ class _DefParser:
         :param source: path to the file.
         :returns Element: root Element"""
         self.file_path = source
+        stat = os.stat(source)
         document = self._open(self.file_path)
+        # Remembered so that writing the tree back can tell if the document would change without reading it again
+        self.source_state = (os.path.realpath(source), stat.st_size, stat.st_mtime_ns, _digest(document))
         return self._parse(document)
 
     @classmethod
-    def serialize(cls, element, internal=False):
+    def serialize(cls, element):
         """Returns a string of the element"""
+        return "".join(cls._iter_serialize(element))
+
+    @classmethod
+    def serialize_to(cls, element, stream, buffer_size=65536):
+        """Writes the text of the element to stream, in chunks of roughly buffer_size characters"""
+        chunks = []
+        size = 0
+        for text in cls._iter_serialize(element):
+            chunks.append(text)
+            size += len(text)
+            if size >= buffer_size:
+                stream.write("".join(chunks))
+                chunks.clear()
+                size = 0
+        stream.write("".join(chunks))
+
+    @classmethod
+    def _iter_serialize(cls, element, depth=0):
+        """Yields the text of the children of element in chunks. The text is escaped as it is written when element
+        is the document of a data element embedded depth levels down"""
         assert_is_element(element)
+        yield from cls._iter_element(element, -1, depth)
 
-        def construct_string(node):
-            """Recursive function that formats the text"""
-            nonlocal output_string
-            nonlocal level
-            for child in node:
-                element_level = cls._get_level(child)
-                if is_element(child):
-                    if child.name == "data" and not internal:
-                        value = cls._escape_element(child)
-                        output_string += "{}{}: {}\n".format("  " * element_level, child.name, value)
-                    else:
-                        level += 1
-                        output_string += "{}{} {{\n".format("  " * element_level, child.name)
-                        construct_string(child)
-                elif is_attribute(child):
-                    output_string += "{}{}: {}\n".format("  " * element_level, child.name, child.string)
+    @classmethod
+    def _iter_element(cls, element, level, depth):
+        """Yields the text of element and its children indented level steps in a document embedded depth levels
+        down, or only of its children as a document if level is -1. Each element keeps its own text, as a list of
+        the lines it writes itself and of its child elements, which write theirs. It is reused until the element
+        changes, so the lines of a tree are only formatted again in the elements that changed and no text of a whole
+        subtree is built or kept"""
+        # The tree is walked with a stack of (segments, child_level, child_depth, split, split_children), split
+        # tells if the text of the segments is split as it is written and split_children if that of the child elements
+        cached = cls._kept_text(element, level, depth)
+        stack = [(iter(cached[2]), cached[3], cached[4], False, cached[5])]
+        while stack:
+            segments, child_level, child_depth, split, split_children = stack[-1]
+            for segment in segments:
+                if segment.__class__ is str:
+                    # Split over several lines after each newline escape the way Defold writes it, an escape is
+                    # never split between two segments
+                    yield segment.replace("\\n", "\\n" + cls._split) if split else segment
+                else:
+                    cached = cls._kept_text(segment, child_level, child_depth)
+                    stack.append((iter(cached[2]), cached[3], cached[4], split_children,
+                                  split_children or cached[5]))
+                    break
+            else:
+                stack.pop()
 
-                if level > element_level and not child.name == "data":
-                    level -= 1
-                    output_string += "{}{}".format("  " * level, "}\n")
+    @classmethod
+    def _kept_text(cls, element, level, depth):
+        """Returns the text element keeps for level and depth, made again if it changed or was made for another
+        place in a document, as (level, depth, segments, child_level, child_depth, split)"""
+        cached = element._text
+        if cached is None or cached[0] != level or cached[1] != depth:
+            cached = element._text = (level, depth) + cls._segments(element, level, depth)
+        return cached
+
+    @classmethod
+    def _segments(cls, element, level, depth):
+        """Returns the text of element for :meth:`_iter_element` as (segments, child_level, child_depth, split).
+        Segments are the text of its own lines and its child elements in order, the children are written indented
+        child_level steps at child_depth and their text is split if split is True"""
+        escape = _EscapeTable.for_depth(depth).escape
+        indent = "  " * level
+        source = element._embedded_source
+        if level < 0:
+            return cls._children_segments(element, 0, depth, "", "", False), 0, depth, False
+        if element.name != "data":
+            return cls._children_segments(element, level + 1, depth, escape("{}{} {{\n".format(indent, element.name)),
+                                          escape("{}}}\n".format(indent)), False), level + 1, depth, False
+        if source is not None:
+            value = _decode(source)
+            if depth:
+                value = value.replace(cls._split, "")
+            elif cls._split not in value:
+                # Read from an embedded document, where it is not split, and moved to the top of a document
+                value = value.replace("\\n", "\\n" + cls._split)
+            return [escape("{}{}: {}\n".format(indent, element.name, value))], 0, depth + 1, False
+        # Nested documents are escaped once, with the table of their own depth
+        split = not depth
+        return cls._children_segments(element, 0, depth + 1, escape('{}{}: "'.format(indent, element.name)),
+                                      escape('"\n'), split), 0, depth + 1, split
 
-        level = 0
-        output_string = ""
-        construct_string(element)
-        return output_string
+    @classmethod
+    def _children_segments(cls, element, level, depth, head, tail, split):
+        """Returns the segments of the children of element indented level steps between the escaped text head and
+        tail. Runs of attributes are joined in chunks of at most _lines_per_chunk lines"""
+        escape = _EscapeTable.for_depth(depth).escape
+        indent = "  " * level
+        children = element._children
+        limit = cls._lines_per_chunk
+        if len(children) <= limit and not any(isinstance(child, Element) for child in children):
+            # Most elements only hold attributes and are kept as one text
+            text = head + cls._run_text(["{}{}: {}\n".format(indent, child._name, child.string)
+                                         for child in children], escape, split) + tail
+            return [text] if text else []
+
+        segments = []
+        # Escaped text that is joined with the next run of attributes, head and tail are never a segment of their own
+        pending = head
+        lines = []
+        for child in children:
+            if isinstance(child, Element):
+                if lines:
+                    pending += cls._run_text(lines, escape, split)
+                    lines = []
+                if pending:
+                    segments.append(pending)
+                    pending = ""
+                segments.append(child)
+            else:
+                lines.append("{}{}: {}\n".format(indent, child._name, child.string))
+                if len(lines) == limit:
+                    segments.append(pending + cls._run_text(lines, escape, split))
+                    pending = ""
+                    lines = []
+        if lines:
+            pending += cls._run_text(lines, escape, split)
+        pending += tail
+        if pending:
+            segments.append(pending)
+        return segments
+
+    @classmethod
+    def _run_text(cls, lines, escape, split):
+        """Returns the escaped text of a run of attribute lines, split after each newline escape if split is True"""
+        text = escape("".join(lines))
+        return text.replace("\\n", "\\n" + cls._split) if split else text
+
+    @classmethod
+    def first_difference(cls, element, windows):
+        """Compares the text of element with a document given as windows, consecutive bytes-like parts of it, and
+        returns the (line, column) of the first difference or None if they are the same. The text is encoded a part
+        at a time as it is compared, neither it nor the document is held whole"""
+        windows = iter(windows)
+        window = b""
+        start = 0
+        line = 1
+        line_parts = []
+        for data in cls._iter_encoded(element):
+            expected = memoryview(data)
+            position = 0
+            while position < len(data):
+                if start == len(window):
+                    window = next(windows, None)
+                    if window is None:
+                        # The document ended before the text
+                        return line, _column(line_parts)
+                    start = 0
+                size = min(len(data) - position, len(window) - start)
+                same = window[start:start + size] == expected[position:position + size]
+                if not same:
+                    size = _common_prefix(window[start:start + size], expected[position:position + size])
+                newline = data.rfind(b"\n", position, position + size)
+                if newline == -1:
+                    line_parts.append(data[position:position + size])
+                else:
+                    line += data.count(b"\n", position, newline + 1)
+                    line_parts = [data[newline + 1:position + size]]
+                if not same:
+                    return line, _column(line_parts)
+                position += size
+                start += size
+
+        while start == len(window):
+            window = next(windows, None)
+            if window is None:
+                return None
+            start = 0
+        # The document goes on after the text
+        return line, _column(line_parts)
+
+    @classmethod
+    def _iter_encoded(cls, element, size=65536):
+        """Yields the text of element as UTF-8 in parts of at most size characters"""
+        for text in cls._iter_serialize(element):
+            for start in range(0, len(text), size):
+                yield text[start:start + size].encode("utf-8", "surrogateescape")
+
+    @classmethod
+    def node_at_line(cls, element, line):
+        """Returns the node written on line of the text of element, or None if the text has fewer lines, and the list
+        of nodes from the child of element down to it. Embedded documents are not searched, the data element holding
+        the line is returned"""
+        nodes = []
+        parent = element
+        remaining = line - 1
+        while True:
+            for child in parent._children:
+                if isinstance(child, Element):
+                    size = sum(text.count("\n") for text in cls._iter_element(child, len(nodes), 0))
+                else:
+                    size = child.string.count("\n") + 1
+                if remaining < size:
+                    break
+                remaining -= size
+            else:
+                return (nodes[-1] if nodes else None), nodes
+            nodes.append(child)
+            if not isinstance(child, Element) or child.name == "data" or remaining in (0, size - 1):
+                return child, nodes
+            # The line is below the line that opens child
+            remaining -= 1
+            parent = child
 
     def from_string(self, source) -> 'Element':
-        """Parses an Defold section from a string constant
+        """Parses an Defold section from a string constant, or from UTF-8 encoded bytes in any object supporting the
+        buffer protocol such as bytes, memoryview or mmap
 
-        :param source: string to parse.
+        :param source: document to parse.
         :returns Element: root Element"""
 
         return self._parse(source)
 
     @staticmethod
     def _open(path):
-        """Returns the documents data as a string"""
+        """Returns the documents data as bytes"""
 
-        with open(path, "r") as document:
+        with open(path, "rb") as document:
             current_document = document.read()
         return current_document
 
     def _parse(self, input_doc):
         document = input_doc
-        last_index = True
-        while last_index:
+        if document.__class__ is not str and self._carriage_return_regex.search(document):
+            # Line endings are read as in a file opened as text
+            document = bytes(document).replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        position = 0
+        while position is not None:
             try:
-                last_index = self._tree_builder(document)
+                position = self._tree_builder(document, position)
             except IndexError:
                 self._raise_parse_error()
-
-            if last_index:
-                document = document[last_index:]
         return self.root
 
-    @staticmethod
-    def _get_level(child):
-        element_level = -1
-
-        def count_up(child_object, count):
-            parent = child_object.get_parent()
-            if not parent:
-                return count
-
-            return count_up(parent, count+1)
-        return count_up(child, element_level)
-
-    def _tree_builder(self, document):
-        """Searches the document for a match and builds the tree"""
-        regex_match = self._regex.search(document)
-        if not regex_match and len(document) > 25:
+    def _tree_builder(self, document, position=0):
+        """Searches the document from position for a match and builds the tree, returns the position
+        where the next search should start or None when the document is exhausted"""
+        regex = self._regex if document.__class__ is str else self._bytes_regex
+        regex_match = regex.search(document, position)
+        if not regex_match and len(document) - position > 25:
             # If there are more characters than 25 left and we can't find a match we assume that the file is broken
             self._raise_parse_error()
 
         if regex_match:
-            element_name = regex_match.group(3)
-            attribute_name, attribute_value = regex_match.group(1, 2)
-            element_exit = regex_match.group(4)
-
-            if element_name:
+            self._build_node(regex_match)
+            return regex_match.end()
+        return None
+
+    def _build_node(self, regex_match):
+        """Adds the node described by a match of the parser pattern to the tree"""
+        element_name = regex_match.group(3)
+        attribute_name, attribute_value = regex_match.group(1, 2)
+        element_exit = regex_match.group(4)
+        if regex_match.re is self._bytes_regex:
+            # Names are decoded, values are kept as bytes until they are read
+            element_name = element_name and self._decode_name(element_name)
+            attribute_name = attribute_name and self._decode_name(attribute_name)
+            if attribute_value and not self.lazy_types and attribute_name != "data":
+                attribute_value = _decode(attribute_value)
+
+        if element_name:
+            last_element = self._element_chain[-1]
+            element = last_element.add_element(element_name)
+            self._element_chain.append(element)
+            self._emit("start", element)
+        elif attribute_name and attribute_value:
+            # Attribute called "data" is handled differently because its value is a document and
+            # need to be parsed differently
+
+            if attribute_name == "data":
                 last_element = self._element_chain[-1]
-                element = last_element.add_element(element_name)
+                element = last_element.add_element("data")
+                if self.lazy_data:
+                    # The embedded document is kept as source and parsed when its children are first needed
+                    element._embedded_source = attribute_value
+                    del element._children
+                    return
                 self._element_chain.append(element)
-            elif attribute_name and attribute_value:
-                # Attribute called "data" is handled differently because its value is a document and
-                # need to be parsed differently
-
-                if attribute_name == "data":
-                    attribute_value = bytes(attribute_value, "utf-8").decode("unicode_escape").replace('\n"\n  "',
-                                                                                                       "\n")[1:-1]
-                    last_element = self._element_chain[-1]
-                    element = last_element.add_element("data")
-                    self._element_chain.append(element)
-                    self._parse(attribute_value)
-                    self._element_chain.pop()
+                self._emit("start", element)
+                self._parse(self._decode_data(attribute_value))
+                self._element_chain.pop()
+                self._emit("end", element)
+            else:
+                last_element = self._element_chain[-1]
+                if self.lazy_types:
+                    attribute = _DeferredAttribute(last_element, attribute_name, attribute_value)
                 else:
-                    last_element = self._element_chain[-1]
-                    last_element.add_attribute(attribute_name, attribute_value)
+                    attribute = last_element.add_attribute(attribute_name, attribute_value)
+                self._emit("attribute", attribute)
 
-            elif element_exit:
-                self._element_chain.pop()
+        elif element_exit:
+            self._emit("end", self._element_chain.pop())
 
-            return regex_match.end()
-        return False
+    def _decode_name(self, name):
+        """Returns the decoded name, each name is decoded once per parser"""
+        try:
+            return self._names[name]
+        except KeyError:
+            decoded = self._names[name] = intern(_decode(name))
+            return decoded
 
-    @classmethod
-    def _escape_element(cls, ele):
-        def yield_attributes(element_parent):
-            for child in element_parent:
-                if is_attribute(child):
-                    yield child
+    @staticmethod
+    def _to_records(element) -> list:
+        """Returns the tree below element as a flat list of (depth, name, value) records in document order. value is
+        None for an element, the text of the value for an attribute and a 1-tuple holding the source of an embedded
+        document that has not been parsed. The records are plain tuples of strings, cheap to pickle or marshal"""
+        records = []
+        stack = [iter(element)]
+        while stack:
+            for child in stack[-1]:
+                depth = len(stack) - 1
+                # Names are interned so each is stored once when the records are marshalled
+                name = intern(child.name)
+                if not is_element(child):
+                    records.append((depth, name, child.string))
+                    continue
+                # Read once, another thread may parse the embedded document and clear it meanwhile
+                source = child._embedded_source
+                if source is not None:
+                    records.append((depth, name, (source,)))
                 else:
-                    yield from yield_attributes(child)
-        data_elements = dict()
-        data_elements[cls._get_level(ele)] = [ele]
-
-        for x in ele.iter_elements():
-            if is_element(x) and x.name == "data":
-                lvl = cls._get_level(x)
-                if lvl not in data_elements:
-                    data_elements[lvl] = []
-                data_elements[lvl].append(x)
-
-        while data_elements:
-            for x in data_elements[max(data_elements)]:
-                for a in yield_attributes(x):
-                    if isinstance(a, DefTreeString) and a.string.startswith('"') and a.string.endswith('"'):
-                        a._value = a.string.replace('"', '\\"')
-                _root = DefTree().get_root()
-                attr = _root.add_attribute("data", "")
-                parent = x.get_parent()
-                index = parent.index(x)
-                parent.remove(x)
-                parent.insert(index, attr)
-                x._parent = None
-                text = cls.serialize(x, True)
-                _root.set_attribute("data", '"{}"'.format(text.replace('\"', '\\\"').replace('\n', "\\\n")))
-                del data_elements[max(data_elements)]
-
-        return '"{}"'.format(cls.serialize(ele).replace("\n", '\\n\"\n  \"'))
+                    records.append((depth, name, None))
+                    stack.append(iter(child))
+                    break
+            else:
+                stack.pop()
+        return records
+
+    @staticmethod
+    def _from_records(records, root) -> 'Element':
+        """Rebuilds the tree described by records from :meth:`_to_records` below root, which must be a new element.
+        The nodes are linked directly instead of through append as there is no index to keep up to date"""
+        chain = [root]
+        make_attribute = _DeferredAttribute.__new__
+        for depth, name, value in records:
+            del chain[depth + 1:]
+            parent = chain[depth]
+            if value.__class__ is str:
+                node = make_attribute(_DeferredAttribute)
+                node._name = name
+                node._value = value
+            else:
+                node = parent._makeelement(name)
+                if value is None:
+                    chain.append(node)
+                else:
+                    node._embedded_source = value[0]
+                    del node._children
+            node._parent = parent
+            node._position = len(parent._children)
+            parent._children.append(node)
+        return root
+
+    @classmethod
+    def _decode_data(cls, value):
+        """Returns the document embedded in the value of a data attribute, as UTF-8 encoded bytes"""
+        if value.__class__ is str:
+            value = value.encode("utf-8", "surrogateescape")
+        # Octal escapes are the bytes of UTF-8 encoded characters, so the value is unescaped as bytes
+        return escape_decode(value[1:-1].replace(b'"\n  "', b""))[0]
+
+    def _emit(self, event, node):
+        if self._events is not None and event in self._event_filter:
+            self._events.append((event, node))
+
+    def iterparse(self, source, events, chunk_size) -> Iterator[tuple]:
+        """Reads the file object source in chunks of chunk_size and yields (event, node) pairs
+        as the tree is built. A file object opened in binary mode is read as UTF-8 encoded bytes"""
+        self._event_filter = frozenset(events)
+        self._events = []
+        self.lazy_data = False
+        chunk = source.read(chunk_size)
+        binary = chunk.__class__ is not str
+        if binary:
+            regex, non_space_regex, newline = self._bytes_regex, self._bytes_non_space_regex, b"\n"
+        else:
+            regex, non_space_regex, newline = self._regex, self._non_space_regex, "\n"
+        document = chunk[:0]
+        position = 0
+        end_of_file = False
+        while not end_of_file:
+            end_of_file = not chunk
+            document = document[position:] + chunk
+            position = 0
+            if binary:
+                # Line endings are read as in a file opened as text, a "\r" ending a chunk waits for the next one
+                document = document.replace(b"\r\n", b"\n")
+                if end_of_file:
+                    document = document.replace(b"\r", b"\n")
+
+            # Only complete lines are searched, an attribute value can continue on the lines that follows it
+            # so an attribute that ends the searched text is held back until more of the document is read
+            searchable = len(document) if end_of_file else document.rfind(newline) + 1
+            while True:
+                regex_match = regex.search(document, position, searchable)
+                if not regex_match or (not end_of_file and regex_match.group(2) and
+                                       not non_space_regex.search(document, regex_match.end(), searchable)):
+                    break
+                try:
+                    self._build_node(regex_match)
+                except IndexError:
+                    self._raise_parse_error()
+                position = regex_match.end()
+                yield from self._events
+                self._events.clear()
+            if not end_of_file:
+                chunk = source.read(chunk_size)
+
+        if len(document) - position > 25:
+            self._raise_parse_error()
 
     def _raise_parse_error(self):
         if self.file_path:
@@ -190,16 +537,268 @@ class _DefParser:
         raise ParseError("Error when parsing supplied document") from None
 
 
+class _TreeIndex:
+    """Index of the nodes of a tree by name, and of its attributes by name and value. It is attached to the root
+    :class:`.Element` and kept up to date by the elements and attributes of the tree as they change. The documents
+    of embedded data elements are indexed once they have been parsed."""
+
+    # The number of live indexes, nodes only look for an index to update while there is one
+    count = 0
+    # Reentrant as an index can be released by the garbage collector while the count is being changed
+    _count_lock = RLock()
+    # Weak references to the live indexes, their callbacks lower the count when an index is released
+    _references = set()
+
+    def __init__(self, root):
+        self._by_name = dict()
+        self._by_value = dict()
+        self._keys = dict()
+        with _TreeIndex._count_lock:
+            _TreeIndex.count += 1
+            _TreeIndex._references.add(ref(self, _TreeIndex._release))
+        for child in root._children:
+            self.add(child)
+
+    @staticmethod
+    def _release(reference):
+        with _TreeIndex._count_lock:
+            _TreeIndex._references.discard(reference)
+            _TreeIndex.count -= 1
+
+    @staticmethod
+    def walk(node):
+        """Yields node and the nodes below it, without parsing embedded documents"""
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            yield node
+            if is_element(node) and node._embedded_source is None:
+                stack.extend(reversed(node._children))
+
+    @staticmethod
+    def of(node):
+        """Returns the index of the tree that node is part of, or None"""
+        while node._parent is not None:
+            node = node._parent
+        return node._tree_index if is_element(node) else None
+
+    @classmethod
+    def added(cls, parent, node):
+        index = cls.of(parent)
+        if index is not None:
+            index.add(node)
+
+    @classmethod
+    def removed(cls, parent, node):
+        index = cls.of(parent)
+        if index is not None:
+            index.discard(node)
+
+    @classmethod
+    def changed(cls, node):
+        index = cls.of(node)
+        if index is not None and id(node) in index._keys:
+            index._remove(node)
+            index._insert(node)
+
+    def add(self, node):
+        for node in self.walk(node):
+            if id(node) not in self._keys:
+                self._insert(node)
+
+    def discard(self, node):
+        for node in self.walk(node):
+            if id(node) in self._keys:
+                self._remove(node)
+
+    def _insert(self, node):
+        key = id(node)
+        self._by_name.setdefault(node.name, dict())[key] = node
+        value_key = None
+        if is_attribute(node):
+            value_key = (node.name, node.value)
+            self._by_value.setdefault(value_key, dict())[key] = node
+        self._keys[key] = (node.name, value_key)
+
+    def _remove(self, node):
+        key = id(node)
+        name, value_key = self._keys.pop(key)
+        del self._by_name[name][key]
+        if value_key is not None:
+            del self._by_value[value_key][key]
+
+    def lookup(self, name, value=None):
+        if value is None:
+            return list(self._by_name.get(name, dict()).values())
+        return list(self._by_value.get((name, value), dict()).values())
+
+
+class _PathQuery:
+    """A compiled path for :meth:`.Element.iterfind`. A path is a sequence of steps separated by "/", or by "//"
+    to search the whole subtree instead of only the children. A step is a name, "*" for any name, "." for the
+    current element or ".." for its parent, followed by any number of predicates: [name] requires a child with
+    that name and [name=value] an attribute with that name whose value is value as it is written in a document,
+    so [x=1.5] also matches an attribute written as x: 1.50"""
+    _token_regex = re_compile(r'(//?)|(\*|\.\.?|\w+)|\[\s*(\w+)\s*(?:=\s*("[^"]*"|\'[^\']*\'|[^\]\s]+)\s*)?\]')
+    _cache = dict()
+    _cache_size = 256
+
+    def __init__(self, path):
+        self.steps = []
+        descendant = False
+        expect_step = True
+        position = 0
+        while position < len(path):
+            token = self._token_regex.match(path, position)
+            if not token:
+                raise ValueError("invalid path {!r}".format(path))
+            separator, name, predicate_name, predicate_value = token.groups()
+            position = token.end()
+            if separator:
+                if expect_step and (self.steps or separator == "/"):
+                    raise ValueError("invalid path {!r}".format(path))
+                descendant = separator == "//"
+                expect_step = True
+            elif name:
+                if not expect_step or (descendant and name in (".", "..")):
+                    raise ValueError("invalid path {!r}".format(path))
+                self.steps.append((descendant, name, []))
+                expect_step = False
+            else:
+                if expect_step:
+                    raise ValueError("invalid path {!r}".format(path))
+                if predicate_value and predicate_value.startswith("'"):
+                    predicate_value = '"{}"'.format(predicate_value[1:-1])
+                self.steps[-1][2].append((predicate_name, predicate_value))
+        if expect_step:
+            raise ValueError("invalid path {!r}".format(path))
+
+    @classmethod
+    def compile(cls, path):
+        """Returns the compiled query for path, queries are cached so a path is only compiled once"""
+        query = cls._cache.get(path)
+        if query is None:
+            if len(cls._cache) >= cls._cache_size:
+                cls._cache.clear()
+            query = cls._cache[path] = cls(path)
+        return query
+
+    def iterate(self, element):
+        """Returns an iterator over the nodes below element that match the path, in document order"""
+        nodes = iter((element,))
+        for descendant, name, predicates in self.steps:
+            nodes = self._select(nodes, descendant, name, predicates)
+        return nodes
+
+    @classmethod
+    def _select(cls, nodes, descendant, name, predicates):
+        seen = set() if descendant or name == ".." else None
+        for node in nodes:
+            if name == ".":
+                candidates = (node,)
+            elif name == "..":
+                candidates = () if node.get_parent() is None else (node.get_parent(),)
+            elif not is_element(node):
+                continue
+            elif descendant:
+                candidates = node.iter() if name == "*" else (child for child in node.iter() if child.name == name)
+            else:
+                candidates = node if name == "*" else node._children_named(name)
+
+            for candidate in candidates:
+                if seen is not None:
+                    if id(candidate) in seen:
+                        continue
+                    seen.add(id(candidate))
+                if not predicates or cls._matches(candidate, predicates):
+                    yield candidate
+
+    @staticmethod
+    def _has_value(attribute, text):
+        """Returns True if the value of attribute is the value text is read as. Text that is not written the same
+        way is compared as a value of the attribute's type, so the result is the same before and after the attribute
+        is resolved"""
+        if attribute.string == text:
+            return True
+        attribute_class = attribute._resolve() if type(attribute) is _DeferredAttribute else type(attribute)
+        try:
+            return attribute_class._convert(text) == attribute._value
+        except ValueError:
+            return False
+
+    @staticmethod
+    def _matches(node, predicates):
+        if not is_element(node):
+            return False
+        for name, value in predicates:
+            for child in node._children_named(name):
+                if value is None or (is_attribute(child) and _PathQuery._has_value(child, value)):
+                    break
+            else:
+                return False
+        return True
+
+
+def _index_child(index, child):
+    """Adds child to an index of children by name, see :meth:`Element._children_named`"""
+    named = index.get(child.name)
+    if named is None:
+        index[child.name] = child
+    elif named.__class__ is list:
+        named.append(child)
+    else:
+        index[child.name] = [named, child]
+
+
 class Element:
     """Element class. This class defines the Element interface"""
+    __slots__ = ("_name", "_parent", "_position", "_children", "_moves", "_embedded_source", "_index", "_tree_index",
+                 "_text", "__index")
     __float_regex = re_compile("[-\d]+\.\d+[eE-]+\d+|[-\d]+\.\d+")
     __enum_regex = re_compile('[A-Z_]+')
 
+    # Elements with at least this many children index them by name for lookups, below it a scan is faster than
+    # building and keeping the index
+    _index_threshold = 256
+    # Children that have moved less than this many times since their positions were counted are searched for
+    # around their last known position, else all positions are counted again
+    _position_search_limit = 32
+
     def __init__(self, name: Union['bytes', 'str']):
-        self.name = name
+        self._name = name
         self._parent = None
+        self._position = -1
         self.__index = -1
         self._children = list()
+        self._moves = 0
+        self._embedded_source = None
+        self._index = None
+        self._tree_index = None
+        self._text = None
+
+    def __getattr__(self, name):
+        if name != "_children":
+            raise AttributeError("{!r} object has no attribute {!r}".format(self.__class__.__name__, name))
+
+        # An unparsed embedded document, parse it now that its children are needed. Threads reading the same tree
+        # parse it one at a time and the children are only given to this element once all of them are parsed
+        with _embedded_locks[id(self) % len(_embedded_locks)]:
+            if self._embedded_source is None:
+                # Parsed by another thread while this one waited, or not an embedded document
+                return object.__getattribute__(self, name)
+            holder = self._makeelement(self._name)
+            _DefParser(holder).from_string(_DefParser._decode_data(self._embedded_source))
+            children = holder._children
+            for child in children:
+                child._parent = self
+            self._children = children
+            self._embedded_source = None
+            # Its text came from the source, it is now made from the text of the new children
+            self._dirty()
+            if _TreeIndex.count:
+                for child in children:
+                    _TreeIndex.added(self, child)
+        return children
 
     def __iter__(self):
         self.__index = -1
@@ -219,10 +818,29 @@ class Element:
 
     def __setitem__(self, index: 'int', item: Union['Element', 'Attribute']):
         assert_is_element_or_attribute(item)
+        replaced = self._children[index]
+        position = index if index >= 0 else index + len(self._children)
+        if self._index is not None:
+            self._index_remove(replaced, position)
+        item._parent = self
         self._children[index] = item
-
-    def __delitem__(self, index: 'int'):  # pragma: no cover
+        item._position = position
+        if self._index is not None:
+            self._index_insert(item, position)
+        self._dirty()
+        if _TreeIndex.count:
+            _TreeIndex.removed(self, replaced)
+            _TreeIndex.added(self, item)
+
+    def __delitem__(self, index: 'int'):
+        removed = self._children[index]
+        if self._index is not None:
+            self._index_remove(removed, index if index >= 0 else index + len(self._children))
         del self._children[index]
+        self._moves += 1
+        self._dirty()
+        if _TreeIndex.count:
+            _TreeIndex.removed(self, removed)
 
     def __len__(self):
         return len(self._children)
@@ -230,9 +848,10 @@ class Element:
     def __repr__(self):
         return '{0}({1!r})'.format(self.__class__.__name__, self.name)
 
-    def __get_type(self, x):
+    @classmethod
+    def __get_type(cls, x):
 
-        num_match = self.__float_regex.match(str(x))
+        num_match = cls.__float_regex.match(str(x))
         if num_match:
             if isinstance(x, float) or len(num_match.group(0)) == len(x):
                 return float
@@ -244,6 +863,81 @@ class Element:
             return str
         return int
 
+    @property
+    def name(self):
+        """The name of the element, used to set and get the name"""
+
+        return self._name
+
+    @name.setter
+    def name(self, v: Union['bytes', 'str']):
+        self._name = v
+        if self._parent is not None:
+            self._parent._index = None
+        self._dirty()
+        if _TreeIndex.count:
+            _TreeIndex.changed(self)
+
+    def _dirty(self):
+        """Drops the text kept for this element when it or one of its attributes changes. The text of its ancestors
+        holds the element itself rather than its text, so it stays as it is"""
+        self._text = None
+
+    def _children_named(self, name):
+        """Returns the children whose name matches name, in document order. Wide elements build an index
+        of their children by name the first time it is needed, adding and removing children keeps it up to date.
+        The index holds the child itself for names only one child has and only makes a list for the names that
+        repeat"""
+        index = self._index
+        if index is None:
+            children = self._children
+            if len(children) < self._index_threshold:
+                return (child for child in children if child._name == name)
+            index = dict()
+            for child in children:
+                _index_child(index, child)
+            self._index = index
+        named = index.get(name)
+        if named is None:
+            return ()
+        return named if named.__class__ is list else (named,)
+
+    def _index_slot(self, named, position):
+        """Returns where the child at position goes in named, the children of one name in document order"""
+        low, high = 0, len(named)
+        while low < high:
+            middle = (low + high) // 2
+            if self._position_of(named[middle]) < position:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _index_insert(self, item, position):
+        """Adds item, inserted at position among the children, to the index of the children by name"""
+        index = self._index
+        named = index.get(item.name)
+        if named is None:
+            index[item.name] = item
+            return
+        if named.__class__ is not list:
+            named = index[item.name] = [named]
+        named.insert(self._index_slot(named, position), item)
+
+    def _index_remove(self, item, position):
+        """Removes item, still at position among the children, from the index of the children by name"""
+        index = self._index
+        named = index.get(item.name)
+        if named is item:
+            del index[item.name]
+        elif named.__class__ is list:
+            slot = self._index_slot(named, position)
+            if slot >= len(named) or named[slot] is not item:
+                slot = next(slot for slot, other in enumerate(named) if other is item)
+            del named[slot]
+            if len(named) == 1:
+                index[item.name] = named[0]
+
     def _makeelement(self, name):
         """Returns a new element.
         Do not call this method, use the add_element factory function instead."""
@@ -255,22 +949,26 @@ class Element:
         self.append(element)
         return element
 
-    def _make_attribute(self, name, v):
-        if v is None:
-            return DefTreeString(self, name, "")
-
-        enum_match = self.__enum_regex.match(str(v))
+    @classmethod
+    def _attribute_class(cls, v):
+        """Returns the :class:`.Attribute` class that holds the value v"""
+        enum_match = cls.__enum_regex.match(str(v))
         if isinstance(v, bool) or v == "true" or v == "false":
-            return DefTreeBool(self, name, v)
+            return DefTreeBool
         elif enum_match and len(enum_match.group(0)) == len(v):
-            return DefTreeEnum(self, name, v)
+            return DefTreeEnum
 
-        a_type = self.__get_type(v)
+        a_type = cls.__get_type(v)
         if a_type is int:
-            return DefTreeInt(self, name, v)
+            return DefTreeInt
         elif a_type is float:
-            return DefTreeFloat(self, name, v)
-        return DefTreeString(self, name, v)
+            return DefTreeFloat
+        return DefTreeString
+
+    def _make_attribute(self, name, v):
+        if v is None:
+            return DefTreeString(self, name, "")
+        return self._attribute_class(v)(self, name, v)
 
     def add_attribute(self, name: Union['bytes', 'str'], value: Union['bytes', 'str', 'float', 'int', 'bool']) -> Union[
                       'DefTreeBool', 'DefTreeEnum', 'DefTreeFloat', 'DefTreeInt', 'DefTreeString']:
@@ -280,25 +978,86 @@ class Element:
         return attr
 
     def index(self, item: Union['Element', "Attribute"]) -> 'int':
-        """Returns the index of the item in this element, raises `ValueError` if not found."""
-        for i, child in enumerate(self._children):
-            if child is item:
-                return i
-        raise ValueError("{} is not in children".format(item))
+        """Returns the index of the item in this element, raises `ValueError` if not found. This is quick when few
+        children have been inserted or removed since it was last called, otherwise it counts all children again."""
+        position = self._position_of(item)
+        if position < 0:
+            raise ValueError("{} is not in children".format(item))
+        return position
+
+    def _position_of(self, item):
+        """Returns the position of item among the children, or -1. Each child keeps its position, when children
+        have been inserted or removed before it since then it is searched for within that many places. After
+        _position_search_limit such moves all positions are counted again, so a lookup costs the number of moves
+        since the last count and one in every _position_search_limit moves costs a pass over the children"""
+        children = self._children
+        position = item._position
+        if 0 <= position < len(children) and children[position] is item:
+            return position
+
+        moves = self._moves
+        if moves < self._position_search_limit:
+            for position in range(max(0, position - moves), min(len(children), position + moves + 1)):
+                if children[position] is item:
+                    item._position = position
+                    return position
+
+        for position, child in enumerate(children):
+            child._position = position
+        self._moves = 0
+        position = item._position
+        return position if 0 <= position < len(children) and children[position] is item else -1
 
     def insert(self, index: 'int', item: Union['Element', 'Attribute']):
         """Inserts the item at the given position in this element.
         Raises `TypeError` if item is not a :class:`.Element` or :class:`.Attribute`"""
         assert_is_element_or_attribute(item)
         item._parent = self
-        self._children.insert(index, item)
+        children = self._children
+        size = len(children)
+        children.insert(index, item)
+        # Inserting before the end moves the children after it
+        item._position = min(max(index + size if index < 0 else index, 0), size)
+        if item._position < size:
+            self._moves += 1
+        if self._index is not None:
+            self._index_insert(item, item._position)
+        self._dirty()
+        if _TreeIndex.count:
+            _TreeIndex.added(self, item)
 
     def append(self, item: Union['Element', 'Attribute']):
         """Inserts the item at the end of this element's internal list of children.
                Raises `TypeError` if item is not a :class:`.Element` or :class:`.Attribute`"""
         assert_is_element_or_attribute(item)
         item._parent = self
+        item._position = len(self._children)
         self._children.append(item)
+        if self._text is not None:
+            self._dirty()
+        if self._index is not None:
+            _index_child(self._index, item)
+        if _TreeIndex.count:
+            _TreeIndex.added(self, item)
+
+    def extend(self, items):
+        """Appends the items to the end of this element's internal list of children.
+        Raises `TypeError` if any item is not a :class:`.Element` or :class:`.Attribute`"""
+        items = list(items)
+        for item in items:
+            assert_is_element_or_attribute(item)
+        children = self._children
+        for position, item in enumerate(items, len(children)):
+            item._parent = self
+            item._position = position
+        children.extend(items)
+        self._dirty()
+        if self._index is not None:
+            for item in items:
+                _index_child(self._index, item)
+        if _TreeIndex.count:
+            for item in items:
+                _TreeIndex.added(self, item)
 
     def iter(self) -> Iterator[Union['Element', 'Attribute']]:
         """Creates a tree iterator with the current element as the root. The iterator iterates over this
@@ -355,9 +1114,8 @@ class Element:
         Only :class:`.Attributes`. Name and value are optional and used for filters."""
 
         def yield_attributes(attribute_name):
-            for child in self:
-                if is_attribute(child) and (attribute_name is None or child.name == attribute_name) and (
-                        value is None or child == value):
+            for child in self if attribute_name is None else self._children_named(attribute_name):
+                if is_attribute(child) and (value is None or child == value):
                     yield child
 
         return yield_attributes(name)
@@ -367,8 +1125,8 @@ class Element:
         Iterates over the current element and returns all elements. If the optional argument name is not None only
         :class:`.Element` with a name equal to name is returned."""
         def yield_elements(elements_name):
-            for child in self:
-                if is_element(child) and (elements_name is None or child.name == elements_name):
+            for child in self if elements_name is None else self._children_named(elements_name):
+                if is_element(child):
                     yield child
         return yield_elements(name)
 
@@ -378,44 +1136,265 @@ class Element:
         Returns the first :class:`Attribute` instance whose name matches name and if value is not None whose value equal
         value. If no matching attribute is found it returns None."""
 
-        for child in self:
-            if is_attribute(child) and child.name == name and (value is None or child == value):
+        for child in self._children_named(name):
+            if is_attribute(child) and (value is None or child == value):
                 return child
 
     def get_element(self, name: Union['bytes', 'str']) ->'Element':
         """Returns the first :class:`Element` whose name matches name, if none is found returns None."""
 
-        for child in self:
-            if is_element(child) and child.name == name:
+        for child in self._children_named(name):
+            if is_element(child):
                 return child
 
+    def iterfind(self, path: 'str') -> Iterator[Union['Element', 'Attribute']]:
+        """iterfind(path)
+        Finds all :class:`.Element` and :class:`.Attribute` below this element that match path, for example
+        'nodes[id="button"]/position/x' or '//texture'. Returns an iterator yielding them in document order,
+        the tree is only searched as far as the iterator is consumed."""
+
+        return _PathQuery.compile(path).iterate(self)
+
+    def find(self, path: 'str') -> Union['Element', 'Attribute']:
+        """find(path)
+        Returns the first :class:`.Element` or :class:`.Attribute` that matches path, see :meth:`iterfind`.
+        If nothing matches it returns None."""
+
+        return next(self.iterfind(path), None)
+
+    def findall(self, path: 'str') -> list:
+        """findall(path)
+        Returns a list of all :class:`.Element` and :class:`.Attribute` that match path, see :meth:`iterfind`."""
+
+        return list(self.iterfind(path))
+
+    def to_arrays(self, paths: Iterable) -> tuple:
+        """to_arrays(paths)
+        Returns the values of the number attributes that match each path in paths, see :meth:`iterfind`, as NumPy
+        arrays for changing many values at once. Returns a (handle, arrays) pair, arrays is a dict with a float64
+        array per path in document order. Changed arrays are written back with :meth:`from_arrays` and the handle.
+        Raises `ValueError` if a path matches an attribute that is not a number. Requires NumPy."""
+
+        numpy = _import_numpy()
+        handle = _ArrayHandle()
+        arrays = dict()
+        found = self._find_attributes(paths)
+        for path in paths:
+            attributes = found[path]
+            try:
+                # Parsed values are converted from their text, without making each one a python number first
+                values = numpy.array([attribute.string for attribute in attributes], dtype=numpy.float64)
+            except ValueError:
+                raise ValueError("{} matches attributes that are not numbers".format(path)) from None
+            handle.attributes[path] = attributes
+            handle.values[path] = values.copy()
+            arrays[path] = values
+        return handle, arrays
+
+    def _find_attributes(self, paths):
+        """Returns a dict with the attributes that match each path. Paths that end with the name of an attribute
+        below the same elements, like position/x and position/y, are searched for together"""
+        found = dict()
+        by_parent = dict()
+        for path in paths:
+            parent_path, _, name = path.rpartition("/")
+            if name.isidentifier() and not parent_path.endswith("/"):
+                by_parent.setdefault(parent_path, dict())[name] = found[path] = []
+            else:
+                found[path] = [node for node in self.iterfind(path) if is_attribute(node)]
+
+        for parent_path, named in by_parent.items():
+            steps = parent_path.split("/") if parent_path else []
+            if all(step.isidentifier() for step in steps):
+                # Plain paths are followed through the children directly, without the name index or a query
+                parents = [self]
+                for step in steps:
+                    parents = [child for parent in parents for child in parent._children
+                               if child._name == step and isinstance(child, Element)]
+            else:
+                parents = [parent for parent in self.iterfind(parent_path) if is_element(parent)]
+            for parent in parents:
+                for child in parent._children:
+                    attributes = named.get(child._name)
+                    if attributes is not None and not isinstance(child, Element):
+                        attributes.append(child)
+        return found
+
+    def from_arrays(self, handle: '_ArrayHandle', arrays: dict) -> int:
+        """from_arrays(handle, arrays)
+        Writes arrays of values from :meth:`to_arrays` back to the attributes they were read from. Only the values
+        that changed are written, an int attribute stays an int and its value is truncated like when it is set.
+        Returns the number of attributes that changed."""
+
+        numpy = _import_numpy()
+        changed = 0
+        for path, values in arrays.items():
+            attributes = handle.attributes[path]
+            previous = handle.values[path]
+            values = numpy.asarray(values, dtype=numpy.float64)
+            if values.shape != previous.shape:
+                raise ValueError("{} has {} values, expected {}".format(path, len(values), len(previous)))
+            positions = numpy.flatnonzero(values != previous)
+            written = []
+            for position, value in zip(positions.tolist(), values[positions].tolist()):
+                attribute = attributes[position]
+                if type(attribute) is _DeferredAttribute:
+                    if type(attribute._parent) is Element:
+                        # A number read from a document is a float if it has a decimal point
+                        _set_class(attribute, DefTreeFloat if "." in attribute.string else DefTreeInt)
+                    else:
+                        attribute._resolve()
+                attribute.value = value
+                written.append(attribute.value)
+            written = numpy.array(written, dtype=numpy.float64)
+            changed += int(numpy.count_nonzero(written != previous[positions]))
+            previous[positions] = written
+        return changed
+
     def set_attribute(self, name: Union['bytes', 'str'], value: Union['bytes', 'str', 'float', 'int', 'bool']):
         """Sets the first :class:`Attribute` with name to value."""
 
         element = self.get_attribute(name)
         element.value = value
 
+    def update_attributes(self, name: Union['bytes', 'str', Iterable] = None, where=None, value=None) -> int:
+        """update_attributes([name, where, value])
+        Sets the value of every :class:`.Attribute` below this element in one pass through the tree. Only attributes
+        whose name is name, or one of the names if name is a collection, and for which where(attribute) is true are
+        updated. `value` is the new value, or a function that returns it from the current value. Each value is
+        converted to the type of its attribute as assigning to :attr:`.Attribute.value` would, and all of them are
+        converted before any attribute is changed, so a value that raises `ValueError` leaves the tree as it was.
+        Returns the number of attributes that changed."""
+
+        names = None if name is None else {name} if isinstance(name, (str, bytes)) else set(name)
+        update = value if callable(value) else lambda _: value
+        updates = []
+        stack = [iter(self._children)]
+        while stack:
+            for child in stack[-1]:
+                if isinstance(child, Element):
+                    stack.append(iter(child._children))
+                    break
+                if (names is not None and child._name not in names) or (where is not None and not where(child)):
+                    continue
+                if type(child) is _DeferredAttribute and child.string[:1] == '"' and type(child._parent) is Element:
+                    # Quoted text is always a string, it becomes one without inferring its type
+                    _set_class(child, DefTreeString)
+                # Reading the value resolves a deferred attribute, only then is its class the one to convert with
+                new = update(child.value)
+                new = child._convert(new)
+                if new != child._value:
+                    updates.append((child, new))
+            else:
+                stack.pop()
+
+        for child, new in updates:
+            child._value = new
+            child._changed()
+        return len(updates)
+
     def clear(self):
         """Resets an element. This function removes all children, clears all attributes"""
 
+        if _TreeIndex.count and self._embedded_source is None:
+            for child in self._children:
+                _TreeIndex.removed(self, child)
+        self._dirty()
         self.name = None
         self._parent = None
         self._children = list()
+        self._moves = 0
+        self._embedded_source = None
+        self._index = None
 
     def remove(self, child: Union['Element', 'Attribute']):
         """Removes child from the element. Compares on instance identity not name.
         Raises `TypeError` if child is not a :class:`.Element` or :class:`.Attribute`"""
 
         assert_is_element_or_attribute(child)
-        for index, _child in enumerate(self):
-            if child is _child:
-                del self._children[index]
-
-    def copy(self) -> 'Element':
-        """Returns a deep copy of the current :class:`.Element`."""
-
-        from copy import deepcopy
-        return deepcopy(self)
+        position = self._position_of(child)
+        if position < 0:
+            return
+        if self._index is not None:
+            self._index_remove(child, position)
+        del self._children[position]
+        self._moves += 1
+        self._dirty()
+        if _TreeIndex.count:
+            _TreeIndex.removed(self, child)
+
+    def remove_all(self, predicate) -> list:
+        """remove_all(predicate)
+        Removes every child for which predicate(child) is true, going through the children once.
+        Returns a list of the removed children."""
+
+        kept = []
+        removed = []
+        for child in self._children:
+            (removed if predicate(child) else kept).append(child)
+        if removed:
+            self._replace_children(kept, removed)
+        return removed
+
+    def replace_children(self, items):
+        """replace_children(items)
+        Replaces all children of this element with items, in one pass.
+        Raises `TypeError` if any item is not a :class:`.Element` or :class:`.Attribute`"""
+
+        items = list(items)
+        for item in items:
+            assert_is_element_or_attribute(item)
+        for item in items:
+            item._parent = self
+        self._replace_children(items, self._children)
+
+    def _replace_children(self, children, removed):
+        """Makes children the list of children, removed are the former children that are not kept"""
+        for position, child in enumerate(children):
+            child._position = position
+        self._children = children
+        self._moves = 0
+        self._index = None
+        self._dirty()
+        if _TreeIndex.count:
+            for child in removed:
+                _TreeIndex.removed(self, child)
+            for child in children:
+                _TreeIndex.added(self, child)
+
+    def copy(self, parent: 'Element' = None) -> 'Element':
+        """copy([parent])
+        Returns a deep copy of the current :class:`.Element`. The copy has no parent, unless `parent` is given
+        and it is appended to it."""
+
+        element = self._makeelement(self.name)
+        # The tree is walked with a stack of (original, copy) pairs, the copies are linked to their parent as they
+        # are made and values are shared as they never change in place
+        stack = [(self, element)]
+        while stack:
+            original, copy = stack.pop()
+            # Read once, another thread may parse the embedded document and clear it meanwhile
+            source = original._embedded_source
+            if source is not None:
+                copy._embedded_source = source
+                del copy._children
+                continue
+            children = copy._children
+            for child in original._children:
+                if isinstance(child, Element):
+                    node = child._makeelement(child.name)
+                    stack.append((child, node))
+                else:
+                    node = object.__new__(type(child))
+                    node._name = child._name
+                    node._value = child._value
+                node._parent = copy
+                node._position = len(children)
+                children.append(node)
+
+        if parent is not None:
+            parent.append(element)
+        return element
 
     def get_parent(self) -> 'Element':
         """Returns the parent of the current :class:`.Element`"""
@@ -423,14 +1402,46 @@ class Element:
         return self._parent
 
 
-class Attribute:
+# Locks for parsing embedded documents, shared by elements as they have no room for one each
+_embedded_locks = tuple(RLock() for _ in range(64))
+
+
+class _ArrayHandle:
+    """The attributes whose values :meth:`Element.to_arrays` returned, and the values they had, per path"""
+    __slots__ = ("attributes", "values")
+
+    def __init__(self):
+        self.attributes = dict()
+        self.values = dict()
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("NumPy is needed for arrays of values, "
+                          "install it with 'pip install deftree[numpy]'") from None
+    return numpy
+
+
+class _AttributeType(type):
+    def __instancecheck__(cls, instance):
+        # A deferred attribute becomes its real class before it is checked
+        if type(instance) is _DeferredAttribute:
+            instance._resolve()
+        return issubclass(type(instance), cls)
+
+
+class Attribute(metaclass=_AttributeType):
     """Attribute class. This class defines the Attribute interface."""
+    __slots__ = ("_name", "_value", "_parent", "_position")
 
     def __init__(self, parent: 'Element', name: Union['bytes', 'str'], value):
         self._name = name
+        self._parent = None
+        self._position = -1
         self._value = ""
         self.value = value  # To trigger the setter
-        self._parent = None
         parent.append(self)
 
     @property
@@ -442,6 +1453,9 @@ class Attribute:
     @name.setter
     def name(self, v: Union['bytes', 'str']):
         self._name = v
+        if self._parent is not None:
+            self._parent._index = None
+        self._changed()
 
     @property
     def string(self):
@@ -455,7 +1469,20 @@ class Attribute:
 
     @value.setter
     def value(self, v):
-        self._value = v
+        self._value = self._convert(v)
+        self._changed()
+
+    @staticmethod
+    def _convert(v):
+        """Returns v as it is stored by the value setter, raises ValueError if it isn't a valid value"""
+        return v
+
+    def _changed(self):
+        """Called by the setters when the name or value has changed"""
+        if self._parent is not None:
+            self._parent._dirty()
+        if _TreeIndex.count:
+            _TreeIndex.changed(self)
 
     def __repr__(self):
         return '{0}({1!r}, {2!r})'.format(self.__class__.__name__, self.name, self.value)
@@ -473,6 +1500,8 @@ class Attribute:
 
 
 class DefTreeNumber(Attribute):
+    __slots__ = ()
+
     def __init__(self, parent, name, value):
         super(DefTreeNumber, self).__init__(parent, name, value)
 
@@ -532,6 +1561,8 @@ class DefTreeNumber(Attribute):
 
 
 class DefTreeFloat(DefTreeNumber):
+    __slots__ = ()
+
     def __init__(self, parent, name, value):
         super(DefTreeFloat, self).__init__(parent, name, value)
 
@@ -541,7 +1572,12 @@ class DefTreeFloat(DefTreeNumber):
 
     @value.setter
     def value(self, v):
-        self._value = float(v)
+        self._value = self._convert(v)
+        self._changed()
+
+    @staticmethod
+    def _convert(v):
+        return float(v)
 
     @property
     def string(self):
@@ -556,6 +1592,8 @@ class DefTreeFloat(DefTreeNumber):
 
 
 class DefTreeInt(DefTreeNumber):
+    __slots__ = ()
+
     def __init__(self, parent, name, value):
         super(DefTreeInt, self).__init__(parent, name, value)
 
@@ -565,10 +1603,17 @@ class DefTreeInt(DefTreeNumber):
 
     @value.setter
     def value(self, v):
-        self._value = int(v)
+        self._value = self._convert(v)
+        self._changed()
+
+    @staticmethod
+    def _convert(v):
+        return int(v)
 
 
 class DefTreeString(Attribute):
+    __slots__ = ()
+
     def __init__(self, parent, name, value):
         super(DefTreeString, self).__init__(parent, name, value)
 
@@ -581,12 +1626,16 @@ class DefTreeString(Attribute):
 
     @value.setter
     def value(self, v):
+        self._value = self._convert(v)
+        self._changed()
+
+    @staticmethod
+    def _convert(v):
         if not isinstance(v, str):
             raise ValueError("Expected string got {}".format(type(v)))
         if v.endswith('"') and v.startswith('"'):
-            self._value = v
-        else:
-            self._value = '"{}"'.format(v)
+            return v
+        return '"{}"'.format(v)
 
     def endswith(self, suffix, start=None, end=None):
         return self.value.endswith(suffix, start, end)
@@ -620,6 +1669,7 @@ class DefTreeString(Attribute):
 
 
 class DefTreeEnum(Attribute):
+    __slots__ = ()
     __enum_regex = re_compile('[A-Z_]+')
 
     def __init__(self, parent, name, value):
@@ -631,13 +1681,20 @@ class DefTreeEnum(Attribute):
 
     @value.setter
     def value(self, v):
-        enum_match = self.__enum_regex.match(str(v))
+        self._value = self._convert(v)
+        self._changed()
+
+    @classmethod
+    def _convert(cls, v):
+        enum_match = cls.__enum_regex.match(str(v))
         if not (isinstance(v, str) and enum_match and len(enum_match.group(0)) == len(v)):
             raise ValueError("Unsupported value, enum expected to be an all upper case string.")
-        self._value = v
+        return v
 
 
 class DefTreeBool(Attribute):
+    __slots__ = ()
+
     def __init__(self, parent, name, value):
         super(DefTreeBool, self).__init__(parent, name, value)
 
@@ -651,12 +1708,83 @@ class DefTreeBool(Attribute):
 
     @value.setter
     def value(self, v):
+        self._value = self._convert(v)
+        self._changed()
+
+    @staticmethod
+    def _convert(v):
         if v in ["true", True]:
-            self._value = True
-        elif v in ["false", False]:
-            self._value = False
-        else:
-            raise ValueError("Unsupported boolean value.")
+            return True
+        if v in ["false", False]:
+            return False
+        raise ValueError("Unsupported boolean value.")
+
+
+class _DeferredAttribute(Attribute):
+    """An attribute read from a document. It keeps the text of its value and only when it is first used, or checked
+    with isinstance, does it infer its type and become the matching :class:`.Attribute` class"""
+    __slots__ = ()
+
+    def __init__(self, parent, name, text):
+        self._name = name
+        self._value = text
+        self._parent = None
+        self._position = -1
+        parent.append(self)
+
+    def _resolve(self):
+        parent = self._parent
+        text = self.string
+        attribute_class = (Element if parent is None else type(parent))._attribute_class(text)
+        # Resolving is not a change, the value is converted without the setter so nothing is told and the attribute
+        # stays in its parent, the tree only needs to know if the value is now written differently
+        value = attribute_class._convert(text)
+        _set_class(self, attribute_class)
+        self._value = value
+        if parent is not None and self.string != text:
+            parent._dirty()
+        return attribute_class
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError("{!r} object has no attribute {!r}".format(type(self).__name__, name))
+        self._resolve()
+        return getattr(self, name)
+
+    @property
+    def string(self):
+        text = self._value
+        if text.__class__ is not str:
+            text = self._value = _decode(text)
+        return text
+
+    @property
+    def value(self):
+        self._resolve()
+        return self.value
+
+    @value.setter
+    def value(self, v):
+        self._resolve()
+        self.value = v
+
+
+def _resolving(name):
+    def method(self, *args):
+        self._resolve()
+        return getattr(self, name)(*args)
+    method.__name__ = name
+    return method
+
+
+# Operators are looked up on the type, so they resolve the attribute before they are forwarded
+for _name in ["__eq__", "__len__", "__repr__", "__contains__", "__lt__", "__le__", "__gt__", "__ge__", "__sub__",
+              "__add__", "__mul__", "__truediv__", "__floordiv__", "__mod__", "__divmod__", "__pow__", "__lshift__",
+              "__rshift__", "__and__", "__xor__", "__or__"]:
+    setattr(_DeferredAttribute, _name, _resolving(_name))
+del _name
+_DeferredAttribute.__hash__ = None
+_set_class = object.__dict__["__class__"].__set__
 
 
 class DefTree:
@@ -664,7 +1792,7 @@ class DefTree:
 
     def __init__(self):
         self.root = Element("root")
-        self._parser = _DefParser
+        self._parser = _DefParser(self.root)
 
     def get_document_path(self) -> str:
         """Returns the path to the parsed document."""
@@ -675,49 +1803,396 @@ class DefTree:
 
         return self.root
 
-    def write(self, file_path: Union['bytes', 'str']=None):
-        """write([file_path])
-        Writes the element tree to a file, as plain text. uses the parsed file as a default"""
-        file_path = file_path or self.get_document_path()
-        with open(file_path, "w") as document:
-            document.write(self._parser.serialize(self.root))
+    def build_index(self):
+        """Indexes all elements and attributes of the tree by name, and all attributes by name and value, for
+        :meth:`lookup`. The index is kept up to date as the tree is changed, until :meth:`drop_index` is called."""
+
+        if self.root._tree_index is None:
+            self.root._tree_index = _TreeIndex(self.root)
+
+    def drop_index(self):
+        """Removes the index built by :meth:`build_index`."""
+
+        self.root._tree_index = None
+
+    def lookup(self, name: Union['bytes', 'str'],
+               value: Union['bytes', 'str', 'float', 'int', 'bool'] = None) -> list:
+        """lookup(name, [value])
+        Returns a list of all :class:`.Element` and :class:`.Attribute` in the tree whose name matches name, if value
+        is not None only the :class:`.Attribute` whose value equal value. Documents of embedded data are included once
+        they have been parsed. With an index from :meth:`build_index` this takes constant time, without it the
+        whole tree is searched."""
+
+        index = self.root._tree_index
+        if index is not None:
+            return index.lookup(name, value)
+        return [node for node in _TreeIndex.walk(self.root) if node is not self.root and node.name == name and
+                (value is None or (is_attribute(node) and node.value == value))]
+
+    def write(self, file_path: Union['bytes', 'str']=None, skip_unchanged: bool = False) -> bool:
+        """write([file_path, skip_unchanged])
+        Writes the element tree to a file, as plain text. uses the parsed file as a default. The tree is written to a
+        temporary file that then replaces the file, which is never left half written. If `skip_unchanged` is True
+        a file that already holds the same text is left as it is, so its modification time does not change. Returns
+        True if the file was written."""
+        file_path = os.path.realpath(file_path or self.get_document_path())
+        source_state = getattr(self._parser, "source_state", None)
+        if not skip_unchanged:
+            _write_atomic(file_path, lambda document: self._parser.serialize_to(self.root, document))
+            if source_state and source_state[0] == file_path:
+                self._parser.source_state = None
+            return True
+
+        text = self._parser.serialize(self.root)
+        digest = _digest(text)
+        try:
+            stat = os.stat(file_path)
+            if source_state and source_state[:3] == (file_path, stat.st_size, stat.st_mtime_ns):
+                # The file is as it was parsed, its hash from then tells if the text is the same
+                if source_state[3] == digest:
+                    return False
+            else:
+                with open(file_path, "rb") as document:
+                    if document.read() == text.encode("utf-8", "surrogateescape"):
+                        return False
+        except OSError:
+            pass
+
+        _write_atomic(file_path, lambda document: document.write(text))
+        if source_state and source_state[0] == file_path:
+            stat = os.stat(file_path)
+            self._parser.source_state = (file_path, stat.st_size, stat.st_mtime_ns, digest)
+        return True
 
     def dump(self):  # pragma: no cover
         """Writes the the DefTree structure to sys.stdout. This function should be used for debugging only."""
 
-        stdout.write(self._parser.serialize(self.root))
+        self._parser.serialize_to(self.root, stdout)
 
     def parse(self, source: Union['bytes', 'str']) -> 'Element':
         """parse(source, [parser])
         Parses a Defold document into this :class:`.DefTree`. It returns the root :class:`.Element` of the DefTree.
         `source` is a file_path."""
 
-        self._parser = _DefParser
-        self._parser.file_path = source
-        parser = self._parser(self.root)
-        return parser.parse(source)
+        self._parser = _DefParser(self.root)
+        return self._parser.parse(source)
 
     def from_string(self, text: Union['bytes', 'str']) -> 'DefTree':
         """from_string(text, [parser])
-        Parses a Defold document section from a string constant which it returns.
+        Parses a Defold document section from a string constant which it returns. `text` can also be UTF-8 encoded
+        bytes, a memoryview or a mmap, values are then only decoded when they are read.
         `parser` is an optional parser instance. If not given the standard parser is used.
         Returns the root of :class:`.DefTree`."""
 
-        self._parser = _DefParser
-        parser = self._parser(self.root)
-        return parser.from_string(text)
+        self._parser = _DefParser(self.root)
+        return self._parser.from_string(text)
+
+
+class ParseCache:
+    """ParseCache(directory, [max_size])
+    A cache of parsed documents stored in directory, for :func:`parse`. A document is parsed once and its tree is
+    stored in a form that loads without tokenizing the document again. A cached tree is used while the size and
+    modification time of the document are the same, or its content hash is when only the time has changed. When the
+    cache grows larger than max_size bytes the least recently used trees are removed. The directory must only be
+    writable by trusted users as the trees are loaded with :mod:`marshal`."""
+
+    # Bumped whenever the stored form changes so older caches are ignored
+    _format = 2
+    _suffix = ".deftree"
+    # The caches made for a directory given to parse as a path, so that they keep count of their size between calls
+    _directories = dict()
+    _directories_lock = RLock()
+
+    def __init__(self, directory: Union['bytes', 'str'], max_size: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self._size = None
+        os.makedirs(directory, exist_ok=True)
+
+    def parse(self, source: Union['bytes', 'str']) -> DefTree:
+        """parse(source)
+        Returns the :class:`.DefTree` of the document at source, from the cache if it has not changed."""
+
+        source_path = os.fsdecode(os.path.abspath(source))
+        entry = os.path.join(self.directory, sha256(os.fsencode(source_path)).hexdigest()[:32] + self._suffix)
+        stat = os.stat(source)
+        cached = self._load(entry, source_path, stat)
+        if cached is not None:
+            records, digest = cached
+            tree = _tree_from_records(source, records)
+        else:
+            with open(source, "rb") as document:
+                text = document.read()
+            digest = _digest(text)
+            tree = DefTree()
+            tree._parser = _DefParser(tree.root)
+            tree._parser.file_path = source
+            tree._parser.from_string(text)
+            self._store(entry, (self._format, source_path, stat.st_size, stat.st_mtime_ns, digest),
+                        _DefParser._to_records(tree.root))
+        tree._parser.source_state = (os.path.realpath(source), stat.st_size, stat.st_mtime_ns, digest)
+        return tree
+
+    @classmethod
+    def _for_directory(cls, directory):
+        """Returns the cache of directory that :func:`parse` uses when it is given the path of the directory"""
+        key = os.path.abspath(directory)
+        with cls._directories_lock:
+            cache = cls._directories.get(key)
+            if cache is None:
+                cache = cls._directories[key] = cls(directory)
+        return cache
+
+    def clear(self):
+        """Removes all trees from the cache"""
+
+        for path in self._entries():
+            os.remove(path)
+        self._size = 0
+
+    def _entries(self):
+        """Returns the paths of the entries in the cache"""
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                if name.endswith(self._suffix)]
+
+    def _stat_entries(self):
+        """Returns the (modification time, size, path) of each entry in the cache"""
+        entries = []
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        return entries
+
+    def _load(self, entry, source_path, stat):
+        """Returns the records cached in entry and the hash of the document if they are still those of the document,
+        else None"""
+        try:
+            with open(entry, "rb") as cached:
+                cache_format, cached_path, size, mtime, digest, records = marshal.loads(cached.read())
+            if cache_format != self._format or cached_path != source_path or size != stat.st_size:
+                return None
+            if mtime != stat.st_mtime_ns:
+                with open(source_path, "rb") as document:
+                    if _digest(document.read()) != digest:
+                        return None
+                # Only the time has changed, store it so the document isn't hashed on every load
+                self._store(entry, (cache_format, cached_path, size, stat.st_mtime_ns, digest), records)
+                return records, digest
+            # The modification time of an entry is the time it was last used
+            os.utime(entry)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        return records, digest
+
+    def _store(self, entry, header, records):
+        """Writes the records to entry through a temporary file, then removes the least recently used entries if the
+        cache has grown too large"""
+        data = marshal.dumps(header + (records,))
+        try:
+            replaced = os.stat(entry).st_size
+        except OSError:
+            replaced = 0
+        try:
+            _write_atomic(entry, lambda cached: cached.write(data), "wb")
+        except OSError:
+            return
+
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._stat_entries())
+        else:
+            self._size += len(data) - replaced
+        if self._size > self.max_size:
+            self._evict()
+
+    def _evict(self):
+        entries = sorted(self._stat_entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+
+
+class Difference:
+    """Difference(line, column, node, path)
+    Where the text of a tree first differs from a document, returned by :func:`compare`. `line` and `column` count
+    from 1 in the document. `node` is the :class:`.Element` or :class:`.Attribute` written on that line, or None if
+    the document goes on after the text ends, and `path` is the names of the nodes down to it separated by "/"."""
+    __slots__ = ("line", "column", "node", "path")
+
+    def __init__(self, line: int, column: int, node, path: str):
+        self.line = line
+        self.column = column
+        self.node = node
+        self.path = path
+
+    def __repr__(self):
+        return "<{} line {}, column {}: {!r}>".format(self.__class__.__name__, self.line, self.column, self.path)
+
+
+class Stats:
+    """Stats()
+    Counters of the work done in this process while they are collected with :func:`stats`, times are in seconds.
+    `decode_time` is part of `parse_time`, `deferred_documents` counts the data documents left unparsed until used.
+    :func:`iterparse`, :class:`ParseCache` hits and the worker processes of :func:`parse_many` and
+    :func:`compare_many` are not measured."""
+    __slots__ = ("parse_time", "decode_time", "infer_time", "serialize_time", "documents", "tokens", "elements",
+                 "attributes", "embedded_documents", "deferred_documents", "bytes_parsed", "characters_serialized",
+                 "attributes_inferred")
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def as_dict(self) -> dict:
+        """Returns the counters as a dict"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return "<{} {}>".format(self.__class__.__name__, " ".join(
+            "{}={}".format(name, getattr(self, name)) for name in self.__slots__))
+
+
+class _Instrumentation:
+    """Counts the work done into the active :class:`Stats`. It replaces the methods it measures while there are any,
+    and puts back the originals after, so that nothing is measured or checked when no one collects"""
+    active = []
+    _originals = None
+    _lock = RLock()
+
+    @classmethod
+    def start(cls, collected):
+        with cls._lock:
+            if cls._originals is None:
+                cls._originals = [(_DefParser, "_parse", _DefParser.__dict__["_parse"]),
+                                  (_DefParser, "_build_node", _DefParser.__dict__["_build_node"]),
+                                  (_DefParser, "_decode_data", _DefParser.__dict__["_decode_data"]),
+                                  (_DefParser, "_iter_serialize", _DefParser.__dict__["_iter_serialize"]),
+                                  (_DeferredAttribute, "_resolve", _DeferredAttribute.__dict__["_resolve"])]
+                _DefParser._parse = cls._parse
+                _DefParser._build_node = cls._build_node
+                _DefParser._decode_data = classmethod(cls._decode_data)
+                _DefParser._iter_serialize = classmethod(cls._iter_serialize)
+                _DeferredAttribute._resolve = cls._resolve
+            cls.active.append(collected)
+
+    @classmethod
+    def stop(cls, collected):
+        with cls._lock:
+            cls.active.remove(collected)
+            if not cls.active and cls._originals is not None:
+                for owner, name, original in cls._originals:
+                    setattr(owner, name, original)
+                cls._originals = None
+
+    @classmethod
+    def add(cls, **counts):
+        with cls._lock:
+            for collected in cls.active:
+                for name, count in counts.items():
+                    setattr(collected, name, getattr(collected, name) + count)
+
+    @staticmethod
+    def _parse(parser, input_doc, _parse=_DefParser._parse):
+        if parser.__dict__.get("_counts") is not None:
+            # A data document parsed as part of the one being measured
+            _Instrumentation.add(documents=1)
+            return _parse(parser, input_doc)
+        # Tokens, elements, attributes and deferred documents, counted by _build_node
+        counts = parser._counts = [0, 0, 0, 0]
+        start = perf_counter()
+        try:
+            return _parse(parser, input_doc)
+        finally:
+            elapsed = perf_counter() - start
+            parser._counts = None
+            _Instrumentation.add(parse_time=elapsed, documents=1, tokens=counts[0], elements=counts[1],
+                                 attributes=counts[2], deferred_documents=counts[3], bytes_parsed=len(input_doc))
+
+    @staticmethod
+    def _build_node(parser, regex_match, _build_node=_DefParser._build_node):
+        counts = parser.__dict__.get("_counts")
+        if counts is not None:
+            counts[0] += 1
+            attribute_name = regex_match.group(1)
+            if regex_match.group(3):
+                counts[1] += 1
+            elif attribute_name in ("data", b"data"):
+                # A data attribute becomes an element
+                counts[1] += 1
+                counts[3] += parser.lazy_data
+            elif attribute_name:
+                counts[2] += 1
+        return _build_node(parser, regex_match)
+
+    @staticmethod
+    def _decode_data(parser_class, value, _decode_data=_DefParser._decode_data.__func__):
+        start = perf_counter()
+        document = _decode_data(parser_class, value)
+        _Instrumentation.add(decode_time=perf_counter() - start, embedded_documents=1)
+        return document
+
+    @staticmethod
+    def _iter_serialize(parser_class, element, depth=0, _iter_serialize=_DefParser._iter_serialize.__func__):
+        if depth:
+            yield from _iter_serialize(parser_class, element, depth)
+            return
+        chunks = _iter_serialize(parser_class, element, depth)
+        while True:
+            start = perf_counter()
+            try:
+                text = next(chunks)
+            except StopIteration:
+                return
+            # Counted as each chunk is made, a caller may stop before the text ends
+            _Instrumentation.add(serialize_time=perf_counter() - start, characters_serialized=len(text))
+            yield text
+
+    @staticmethod
+    def _resolve(attribute, _resolve=_DeferredAttribute._resolve):
+        start = perf_counter()
+        attribute_class = _resolve(attribute)
+        _Instrumentation.add(infer_time=perf_counter() - start, attributes_inferred=1)
+        return attribute_class
+
+
+@contextmanager
+def stats() -> Iterator[Stats]:
+    """stats()
+    A context manager that collects :class:`Stats` of the parsing, serializing and attribute type inference done in
+    the process while it is open::
+
+        with deftree.stats() as counters:
+            deftree.parse(path)
+        print(counters.parse_time, counters.tokens)
+
+    Nothing is measured, and it costs nothing, when no stats are collected."""
+
+    collected = Stats()
+    _Instrumentation.start(collected)
+    try:
+        yield collected
+    finally:
+        _Instrumentation.stop(collected)
 
 
 def is_element(item: 'Element') -> bool:
     """Returns True if the item is an :class:`.Element` else returns False"""
-    if isinstance(item, Element):
+    if issubclass(type(item), Element):
         return True
     return False
 
 
 def is_attribute(item: Attribute) -> bool:
     """Returns True if the item is an :class:`.Attribute` else returns False"""
-    if issubclass(item.__class__, Attribute):
+    if issubclass(type(item), Attribute):
         return True
     return False
 
@@ -731,18 +2206,245 @@ def to_string(element: Element) -> str:
     return _DefParser.serialize(element)
 
 
-def parse(source: Union['bytes', 'str']) -> DefTree:
-    """Parses a Defold document into a DefTree which it returns. `source` is a file_path.
-    `parser` is an optional parser instance. If not given the standard parser is used."""
+def to_stream(element: Element, stream):
+    """to_stream(element, stream)
+    Writes the string representation of the Element, including all children, to the text file object `stream`
+    in chunks, without building the whole document as a single string.
+    `element` is a :class:`.Element` instance."""
+
+    assert_is_element(element)
+    _DefParser.serialize_to(element, stream)
+
 
+def parse(source: Union['bytes', 'str'], cache: Union['ParseCache', 'str'] = None) -> DefTree:
+    """parse(source, [cache])
+    Parses a Defold document into a DefTree which it returns. `source` is a file_path.
+    `cache` is an optional :class:`ParseCache`, or the path of its directory, that returns the tree without parsing
+    the document again when it has not changed since it was cached."""
+
+    if cache is not None:
+        if not isinstance(cache, ParseCache):
+            cache = ParseCache._for_directory(cache)
+        return cache.parse(source)
     tree = DefTree()
     tree.parse(source)
     return tree
 
 
+def _decode(value):
+    """Returns the text of a value read from a document, which is kept as bytes until it is needed"""
+    if value.__class__ is str:
+        return value
+    return value.decode("utf-8", "surrogateescape")
+
+
+def _column(line_parts):
+    """Returns the column, counted in characters from 1, that follows the UTF-8 encoded parts of a line"""
+    return len(b"".join(line_parts).decode("utf-8", "surrogateescape")) + 1
+
+
+def _common_prefix(first, second):
+    """Returns the number of leading bytes that are the same in two bytes-like objects of the same length that
+    differ, searched by halving so the bytes are compared in C"""
+    low, high = 0, len(first)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if first[low:middle] == second[low:middle]:
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def _digest(document):
+    """Returns the hash of a document, as text or as the bytes of the file, used to tell if it has changed"""
+    if document.__class__ is str:
+        document = document.encode("utf-8", "surrogateescape")
+    return sha256(document).digest()[:16]
+
+
+def _write_atomic(path, write, mode="w"):
+    """Calls write with a temporary file next to path, then replaces path with it. The file keeps its permissions.
+    Text is written with LF line endings on every platform, the same bytes skip_unchanged compares with"""
+    temporary = "{}.{}.{}.tmp".format(path, os.getpid(), get_ident())
+    try:
+        text = "b" not in mode
+        with open(temporary, mode, buffering=1024 * 1024, encoding="utf-8" if text else None,
+                  errors="surrogateescape" if text else None, newline="" if text else None) as stream:
+            write(stream)
+        if os.path.exists(path):
+            os.chmod(temporary, os.stat(path).st_mode & 0o7777)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def _parse_records(path):
+    """Parses the document at path in a worker process of :func:`parse_many`, returns (path, records, error)"""
+    try:
+        tree = parse(path)
+    except (ParseError, OSError) as error:
+        return path, None, error
+    return path, _DefParser._to_records(tree.get_root()), None
+
+
+def _tree_from_records(path, records) -> DefTree:
+    tree = DefTree()
+    tree._parser = _DefParser(tree.root)
+    tree._parser.file_path = path
+    tree._parser._from_records(records, tree.root)
+    return tree
+
+
+def parse_many(paths, workers: int = None, ordered: bool = True) -> Iterator[tuple]:
+    """parse_many(paths, [workers, ordered])
+    Parses the Defold documents at paths in a pool of worker processes. Returns an iterator yielding a (path, result)
+    pair for each path, where result is the :class:`.DefTree` of the document or the :class:`ParseError` or `OSError`
+    raised when it could not be read, a broken document does not stop the others from being parsed. The pairs are
+    yielded in the order of paths, or as the documents are parsed if `ordered` is False. `workers` is the number of
+    processes and defaults to the number of cores, with 1 the documents are parsed in this process. The workers send
+    each tree back as a flat list of records that is rebuilt here, which is much cheaper than pickling elements."""
+
+    from multiprocessing import Pool, cpu_count
+
+    paths = list(paths)
+    workers = min(workers or cpu_count() or 1, len(paths))
+    if workers <= 1:
+        for path in paths:
+            try:
+                result = parse(path)
+            except (ParseError, OSError) as error:
+                result = error
+            yield path, result
+        return
+
+    chunk_size = max(1, min(32, len(paths) // (workers * 4)))
+    with Pool(workers) as pool:
+        results = (pool.imap if ordered else pool.imap_unordered)(_parse_records, paths, chunk_size)
+        for path, records, error in results:
+            yield path, error if error is not None else _tree_from_records(path, records)
+
+
+def compare(element: Union['DefTree', 'Element'], source=None, buffer_size: int = 65536) -> Optional['Difference']:
+    """compare(element, [source, buffer_size])
+    Compares the text element would be written as with the document at source, a path or a file object opened in
+    binary mode. Returns None if they are the same, else a :class:`Difference` describing where they first differ.
+    `element` is either an :class:`.DefTree`, whose document is the default source, or an :class:`.Element`. Every
+    value below element is read first, so they are compared as they are written once read and not as the text they
+    were parsed from. The document is read in chunks of buffer_size bytes into one buffer and compared as the text
+    is serialized, it stops at the first difference and neither is held whole in memory."""
+
+    if isinstance(element, DefTree):
+        source = source or element.get_document_path()
+        element = element.get_root()
+    for attribute in element.iter_attributes():
+        if type(attribute) is _DeferredAttribute:
+            attribute._resolve()
+    buffer = bytearray(buffer_size)
+    if hasattr(source, "readinto"):
+        return _compare(element, _read_windows(source, buffer))
+    with open(source, "rb") as document:
+        return _compare(element, _read_windows(document, buffer))
+
+
+def compare_many(paths, workers: int = None, ordered: bool = True) -> Iterator[tuple]:
+    """compare_many(paths, [workers, ordered])
+    Parses each of the Defold documents at paths and compares the text of its tree with the document, as
+    :func:`compare` does, in a pool of worker processes. Returns an iterator yielding a (path, result) pair for each
+    path, where result is None if the tree is written exactly as the document, the :class:`Difference` if it is not
+    or the :class:`ParseError` or `OSError` raised when it could not be read. The pairs are yielded in the order of
+    paths, or as the documents are compared if `ordered` is False. `workers` is the number of processes and defaults
+    to the number of cores, with 1 the documents are compared in this process. Each document is read once into a
+    buffer, it is both parsed and compared from there. The workers send the tree of a document that differs back as
+    records, as :func:`parse_many` does, so that the :class:`Difference` holds a node of a tree."""
+
+    from multiprocessing import Pool, cpu_count
+
+    paths = list(paths)
+    workers = min(workers or cpu_count() or 1, len(paths))
+    if workers <= 1:
+        buffer = bytearray()
+        for path in paths:
+            try:
+                root, view, buffer = _parse_document(path, buffer)
+            except (ParseError, OSError) as error:
+                yield path, error
+                continue
+            yield path, _compare(root, (view,))
+        return
+
+    chunk_size = max(1, min(32, len(paths) // (workers * 4)))
+    with Pool(workers) as pool:
+        results = (pool.imap if ordered else pool.imap_unordered)(_compare_result, paths, chunk_size)
+        for path, difference, error in results:
+            if difference is not None:
+                line, column, records = difference
+                error = _difference(_tree_from_records(path, records).get_root(), line, column)
+            yield path, error
+
+
+def _parse_document(path, buffer):
+    """Reads the document at path into buffer and parses it with every value read, the way it is written once it is
+    used. Returns the root, the bytes of the document and the buffer to read the next document into"""
+    with open(path, "rb") as document:
+        size = os.fstat(document.fileno()).st_size
+        if len(buffer) < size:
+            # A new buffer, as a resized one could still be referenced by the last document
+            buffer = bytearray(max(size, 2 * len(buffer)))
+        view = memoryview(buffer)[:size]
+        view = view[:document.readinto(view)]
+    root = DefTree().get_root()
+    parser = _DefParser(root, lazy_data=False, lazy_types=False)
+    parser.file_path = path
+    parser.from_string(view)
+    return root, view, buffer
+
+
+# The buffer a worker process of compare_many reads each document into
+_compare_buffer = bytearray()
+
+
+def _compare_result(path):
+    """Compares the document at path in a worker process of :func:`compare_many`, returns (path, difference, error)
+    where difference is None or the line, column and records of the tree for a document that differs"""
+    global _compare_buffer
+    try:
+        root, view, _compare_buffer = _parse_document(path, _compare_buffer)
+        difference = _DefParser.first_difference(root, (view,))
+    except (ParseError, OSError) as error:
+        return path, None, error
+    if difference is None:
+        return path, None, None
+    return path, difference + (_DefParser._to_records(root),), None
+
+
+def _compare(element, windows):
+    difference = _DefParser.first_difference(element, windows)
+    if difference is None:
+        return None
+    return _difference(element, *difference)
+
+
+def _difference(element, line, column):
+    node, nodes = _DefParser.node_at_line(element, line)
+    return Difference(line, column, node, "/".join(node.name for node in nodes))
+
+
+def _read_windows(stream, buffer):
+    """Yields what is read from stream into buffer, each window is overwritten by the next"""
+    view = memoryview(buffer)
+    size = stream.readinto(buffer)
+    while size:
+        yield view[:size]
+        size = stream.readinto(buffer)
+
+
 def from_string(text: Union['bytes', 'str']) -> DefTree:
     """from_string(text, [parser])
-    Parses a Defold document section from a string constant which it returns. `parser` is an optional parser instance.
+    Parses a Defold document section from a string constant which it returns. `text` can also be UTF-8 encoded bytes,
+    a memoryview or a mmap, values are then only decoded when they are read. `parser` is an optional parser instance.
         If not given the standard parser is used. Returns the root of :class:`.DefTree`."""
 
     tree = DefTree()
@@ -750,6 +2452,29 @@ def from_string(text: Union['bytes', 'str']) -> DefTree:
     return tree
 
 
+def iterparse(source, events: tuple = ("end",), chunk_size: int = 65536) -> Iterator[tuple]:
+    """iterparse(source, [events, chunk_size])
+    Parses a Defold document into a DefTree incrementally, reading it in chunks of chunk_size characters, or bytes
+    if `source` is a file object opened in binary mode. `source` is a file_path or a file object. Returns an iterator
+    yielding (event, node) pairs, `events` is a sequence of the events to report: "start" and "end" are reported
+    with an :class:`.Element` when it is opened and closed, "attribute" with each :class:`.Attribute` as it is added.
+    Elements that are no longer needed can be removed from their parent with :meth:`.Element.remove` on their "end"
+    event to keep the memory usage flat, :meth:`.Element.clear` alone leaves them in the tree."""
+
+    for event in events:
+        if event not in ("start", "end", "attribute"):
+            raise ValueError("unknown event {!r}".format(event))
+
+    tree = DefTree()
+    parser = _DefParser(tree.get_root())
+    if hasattr(source, "read"):
+        yield from parser.iterparse(source, events, chunk_size)
+    else:
+        parser.file_path = source
+        with open(source, "rb") as document:
+            yield from parser.iterparse(document, events, chunk_size)
+
+
 def dump(element: Element):  # pragma: no cover
     """dump(element, [parser])
     Writes the element tree or element structure to sys.stdout. This function should be used for debugging only.
@@ -757,7 +2482,7 @@ def dump(element: Element):  # pragma: no cover
 
     if isinstance(element, DefTree):
         element = element.get_root()
-    stdout.write(_DefParser.serialize(element))
+    _DefParser.serialize_to(element, stdout)
 
 
 def validate(string: Union['bytes', 'str'], path_or_string: Union['bytes', 'str'], verbose=False) -> bool:
@@ -777,7 +2502,7 @@ def validate(string: Union['bytes', 'str'], path_or_string: Union['bytes', 'str'
         return my_hash
 
     if os_path.isfile(path_or_string):
-        with open(path_or_string, 'r') as read_file:
+        with open(path_or_string, "r", encoding="utf-8") as read_file:
             buf = read_file.read()
             source_hash = _generate_hash(buf.encode('utf-8'))
     else:
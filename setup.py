@@ -47,6 +47,9 @@ setup(
     ],
 
     keywords='defold deftree development',
-    packages=["deftree"]
+    packages=["deftree"],
+    extras_require={
+        'numpy': ['numpy'],
+    }
 
 )
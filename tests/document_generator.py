@@ -0,0 +1,278 @@
+"""Generates valid Defold documents of any size for tests and benchmarks.
+
+    python document_generator.py 10MB -o big.defold --fanout 4 --depth 6 --data-levels 2 --seed 3
+
+:func:`generate` makes a document of roughly a given size out of elements nested depth deep with fanout child elements
+each, attributes of a mix of types and embedded data documents nested data_levels deep. The same arguments and seed
+always make the same document. :func:`wide_gui`, :func:`nested_collection`, :func:`tilemap` and :func:`particlefx`
+make documents shaped like those of a real project.
+"""
+import argparse
+import random
+import re
+from bisect import bisect
+from itertools import accumulate
+
+attribute_types = ("float", "int", "string", "enum", "bool")
+default_mix = {"float": 5, "int": 2, "string": 2, "enum": 1, "bool": 1}
+
+_attribute_names = {
+    "float": ("x", "y", "z", "w", "alpha", "duration", "inherit_velocity", "spread", "t_x", "t_y"),
+    "int": ("tile", "layer", "count", "max_particle_count", "h_flip", "v_flip", "scale_along_z"),
+    "string": ("id", "name", "texture", "font", "material", "component", "parent", "animation"),
+    "enum": ("type", "blend_mode", "pivot", "xanchor", "yanchor", "adjust_mode", "mode", "space"),
+    "bool": ("inherit_alpha", "enabled", "visible", "clipping_visible", "template_node_child"),
+}
+_element_names = ("nodes", "position", "rotation", "scale", "embedded_instances", "components", "layers", "cell",
+                  "emitters", "properties", "points", "modifiers", "textures", "fonts", "instances")
+_enum_values = ("TYPE_BOX", "TYPE_TEXT", "TYPE_PIE", "BLEND_MODE_ALPHA", "BLEND_MODE_ADD", "PIVOT_CENTER",
+                "XANCHOR_NONE", "ADJUST_MODE_FIT", "PLAY_MODE_ONCE", "EMISSION_SPACE_WORLD")
+_words = ("main", "player", "enemy", "gui", "button", "level", "tiles", "sprite", "hero", "coin", "spark", "atlas")
+_size_regex = re.compile(r"(\d+(?:\.\d+)?)\s*([kKmMgG]?)[bB]?$")
+
+
+def _quote(text):
+    """Returns text as the value of a string attribute"""
+    return '"{}"'.format(text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+
+
+def _embed(text):
+    """Returns text as the value of a data attribute, split over lines the way Defold writes it"""
+    return _quote(text).replace("\\n", '\\n"\n  "')
+
+
+def parse_size(size):
+    """Returns the number of bytes in a size such as 512, "64KB" or "1.5MB" """
+    if isinstance(size, int):
+        return size
+    match = _size_regex.match(size.strip())
+    if not match:
+        raise ValueError("invalid size {!r}".format(size))
+    return int(float(match.group(1)) * 1024 ** " kmg".index(match.group(2).lower() or " "))
+
+
+def sweep(start=1024, stop=100 * 1024 * 1024, factor=4):
+    """Yields the sizes from start up to stop, each factor times the one before"""
+    size = parse_size(start)
+    stop = parse_size(stop)
+    while size <= stop:
+        yield size
+        size *= factor
+
+
+class _Writer:
+    """Writes a document of elements and attributes until it has used up its size"""
+
+    def __init__(self, rng, fanout, depth, data_levels, mix, attributes, data_size, top):
+        self.rng = rng
+        self.fanout = fanout
+        self.depth = depth
+        self.data_levels = data_levels
+        self.types = [kind for kind in attribute_types if mix.get(kind)]
+        self.weights = [mix[kind] for kind in self.types]
+        # random.choices is only in Python 3.6 and later, this picks the same way
+        self.cumulative_weights = list(accumulate(self.weights))
+        self.attributes = attributes
+        self.data_size = data_size
+        self.top = top
+        self.parts = []
+        self.size = 0
+
+    def write(self, size):
+        # The first element always holds embedded data so that every level is in the document
+        with_data = self.data_levels > 0
+        while self.size < size:
+            self._element(0, size, with_data)
+            with_data = False
+        return "".join(self.parts)
+
+    def _add(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+
+    def _element(self, level, size, with_data):
+        indent = "  " * level
+        self._add("{}{} {{\n".format(indent, self.rng.choice(_element_names)))
+        for _ in range(self.rng.randint(1, self.attributes)):
+            self._attribute(indent + "  ")
+        if with_data or (self.data_levels and self.rng.random() < 0.05):
+            self._data(indent + "  ")
+        if level + 1 < self.depth:
+            for _ in range(self.fanout):
+                if self.size >= size:
+                    break
+                self._element(level + 1, size, False)
+        self._add("{}}}\n".format(indent))
+
+    def _attribute(self, indent):
+        kind = self.types[bisect(self.cumulative_weights, self.rng.random() * self.cumulative_weights[-1])]
+        rng = self.rng
+        if kind == "float":
+            value = repr(round(rng.uniform(-1000.0, 1000.0), rng.randint(1, 6)))
+        elif kind == "int":
+            value = str(rng.randint(0, 4096))
+        elif kind == "string":
+            value = '"/{}/{}_{}"'.format(rng.choice(_words), rng.choice(_words), rng.randint(0, 99))
+        elif kind == "enum":
+            value = rng.choice(_enum_values)
+        else:
+            value = rng.choice(("true", "false"))
+        self._add("{}{}: {}\n".format(indent, rng.choice(_attribute_names[kind]), value))
+
+    def _data(self, indent):
+        writer = _Writer(self.rng, self.fanout, min(self.depth, 3), self.data_levels - 1,
+                         dict(zip(self.types, self.weights)), self.attributes, self.data_size, False)
+        document = writer.write(self.data_size)
+        self._add("{}data: {}\n".format(indent, _embed(document) if self.top else _quote(document)))
+
+
+def generate(size="64KB", fanout=4, depth=4, data_levels=1, mix=None, attributes=4, data_size="1KB", seed=0) -> str:
+    """Returns the text of a Defold document of about size bytes, made of elements nested up to depth levels with
+    fanout child elements each and up to attributes attributes. mix maps the attribute types "float", "int",
+    "string", "enum" and "bool" to how often they are used. Elements now and then, and always the first one, hold
+    an embedded data document of about data_size bytes, which itself holds data documents until data_levels are
+    nested. The document is the same for the same arguments and seed."""
+    if fanout < 1 or depth < 1 or attributes < 1 or data_levels < 0:
+        raise ValueError("fanout, depth and attributes must be at least 1 and data_levels at least 0")
+    mix = default_mix if mix is None else mix
+    if not any(mix.get(kind) for kind in attribute_types):
+        raise ValueError("mix must give a weight to one of {}".format(", ".join(attribute_types)))
+    writer = _Writer(random.Random(seed), fanout, depth, data_levels, mix, attributes, parse_size(data_size), True)
+    return writer.write(parse_size(size))
+
+
+def _vector(name, indent, x, y, z, w=None):
+    lines = ["{}{} {{".format(indent, name), "{}  x: {}".format(indent, x), "{}  y: {}".format(indent, y),
+             "{}  z: {}".format(indent, z)]
+    if w is not None:
+        lines.append("{}  w: {}".format(indent, w))
+    lines.append("{}}}".format(indent))
+    return "\n".join(lines) + "\n"
+
+
+def wide_gui(nodes):
+    """A gui scene with a flat list of box and text nodes"""
+    parts = ['script: "/main/main.gui_script"\n', 'fonts {\n  name: "vera"\n  font: "/fonts/vera.font"\n}\n',
+             'textures {\n  name: "gui"\n  texture: "/atlas/gui.atlas"\n}\n']
+    for index in range(nodes):
+        text_node = index % 3 == 0
+        parts.append("nodes {\n")
+        parts.append(_vector("position", "  ", index % 720 + 0.5, index % 1280 + 0.25, 0.0, 1.0))
+        parts.append(_vector("rotation", "  ", 0.0, 0.0, index % 360, 1.0))
+        parts.append(_vector("scale", "  ", 1.0, 1.0, 1.0, 1.0))
+        parts.append(_vector("size", "  ", 200.0, 100.0, 0.0, 1.0))
+        parts.append(_vector("color", "  ", 1.0, 0.5, 0.25, 1.0))
+        parts.append("  type: {}\n".format("TYPE_TEXT" if text_node else "TYPE_BOX"))
+        parts.append("  blend_mode: BLEND_MODE_ALPHA\n")
+        parts.append('  text: "{}"\n'.format("Label {}".format(index) if text_node else ""))
+        parts.append('  texture: "gui/button"\n  font: "vera"\n')
+        parts.append('  id: "node{}"\n'.format(index))
+        parts.append("  xanchor: XANCHOR_NONE\n  pivot: PIVOT_CENTER\n  adjust_mode: ADJUST_MODE_FIT\n")
+        if index:
+            parts.append('  parent: "node{}"\n'.format(index // 4))
+        parts.append("  layer: \"\"\n  inherit_alpha: true\n  alpha: 1.0\n  template_node_child: false\n}\n")
+    parts.append("material: \"/builtins/materials/gui.material\"\nadjust_reference: ADJUST_REFERENCE_PARENT\n")
+    return "".join(parts)
+
+
+def _game_object(index, levels):
+    """The text of a game object with a sprite, holding an embedded collection levels further down"""
+    parts = ['components {\n  id: "script"\n  component: "/main/main.script"\n}\n']
+    parts.append('embedded_components {{\n  id: "sprite"\n  type: "sprite"\n  data: {}\n'.format(_quote(
+        'tile_set: "/atlas/main.atlas"\ndefault_animation: "anim{}"\n'
+        'material: "/builtins/materials/sprite.material"\nblend_mode: BLEND_MODE_ALPHA\n'.format(index))))
+    parts.append(_vector("position", "  ", 0.0, 0.0, 0.0))
+    parts.append(_vector("rotation", "  ", 0.0, 0.0, 0.0, 1.0))
+    parts.append("}\n")
+    if levels:
+        parts.append('embedded_components {{\n  id: "factory"\n  type: "collectionfactory"\n  data: {}\n}}\n'.format(
+            _quote(_collection_data(index, levels))))
+    return "".join(parts)
+
+
+def _collection_data(index, levels):
+    return 'name: "level{}"\nembedded_instances {{\n  id: "go{}"\n  data: {}\n}}\n'.format(
+        levels, index, _quote(_game_object(index, levels - 1)))
+
+
+def nested_collection(instances, depth):
+    """A collection of game objects that are each the child of the one before, depth deep, with embedded data"""
+    parts = ['name: "main"\nscale_along_z: 0\n']
+    for index in range(instances):
+        parts.append('embedded_instances {{\n  id: "go{}"\n'.format(index))
+        if index % depth != depth - 1:
+            parts.append('  children: "go{}"\n'.format(index + 1))
+        parts.append("  data: {}\n".format(_embed(_game_object(index, 2))))
+        parts.append(_vector("position", "  ", index * 1.5, -index * 0.5, 0.0))
+        parts.append(_vector("rotation", "  ", 0.0, 0.0, 0.0, 1.0))
+        parts.append(_vector("scale3", "  ", 1.0, 1.0, 1.0))
+        parts.append("}\n")
+    return "".join(parts)
+
+
+def tilemap(width, height, layers):
+    """A tile map with layers of width by height cells"""
+    parts = ['tile_set: "/tiles/level.tilesource"\n']
+    for layer in range(layers):
+        parts.append('layers {{\n  id: "layer{}"\n  z: {}\n  is_visible: 1\n'.format(layer, layer * 0.1))
+        for y in range(height):
+            for x in range(width):
+                parts.append("  cell {{\n    x: {}\n    y: {}\n    tile: {}\n    h_flip: 0\n    v_flip: 0\n  }}\n"
+                             .format(x, y, (x * 7 + y * 3 + layer) % 64))
+        parts.append("}\n")
+    parts.append('material: "/builtins/materials/tile_map.material"\nblend_mode: BLEND_MODE_ALPHA\n')
+    return "".join(parts)
+
+
+def particlefx(emitters, points):
+    """A particle effect with emitters that each have curves of points on their properties and a modifier"""
+    parts = []
+    for index in range(emitters):
+        parts.append('emitters {{\n  id: "emitter{}"\n  mode: PLAY_MODE_ONCE\n  duration: 1.0\n'
+                     '  space: EMISSION_SPACE_WORLD\n'.format(index))
+        parts.append(_vector("position", "  ", 0.0, 0.0, 0.0))
+        parts.append(_vector("rotation", "  ", 0.0, 0.0, 0.0, 1.0))
+        parts.append('  tile_source: "/particles/particles.tilesource"\n  animation: "spark"\n'
+                     '  material: "/builtins/materials/particlefx.material"\n  blend_mode: BLEND_MODE_ADD\n'
+                     '  particle_orientation: PARTICLE_ORIENTATION_DEFAULT\n  inherit_velocity: 0.0\n'
+                     '  max_particle_count: 128\n  type: EMITTER_TYPE_CIRCLE\n  start_delay: 0.0\n')
+        for key in ("EMITTER_KEY_SPAWN_RATE", "EMITTER_KEY_SIZE_X", "EMITTER_KEY_PARTICLE_LIFE_TIME",
+                    "EMITTER_KEY_PARTICLE_SPEED", "EMITTER_KEY_PARTICLE_SIZE", "EMITTER_KEY_PARTICLE_RED"):
+            parts.append("  properties {{\n    key: {}\n".format(key))
+            for point in range(points):
+                parts.append("    points {{\n      x: {}\n      y: {}\n      t_x: 1.0\n      t_y: 0.0\n    }}\n"
+                             .format(point / points, (point * 37 % 100) / 10.0))
+            parts.append("    spread: 0.0\n  }\n")
+        parts.append("  modifiers {\n    type: MODIFIER_TYPE_ACCELERATION\n    use_direction: 0\n")
+        parts.append(_vector("position", "    ", 0.0, 0.0, 0.0))
+        parts.append("    properties {\n      key: MODIFIER_KEY_MAGNITUDE\n      points {\n        x: 0.0\n"
+                     "        y: -100.0\n        t_x: 1.0\n        t_y: 0.0\n      }\n      spread: 0.0\n    }\n  }\n"
+                     "}\n")
+    return "".join(parts)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("size", help="about how large the document is, such as 4096, 64KB or 10MB")
+    parser.add_argument("-o", "--output", required=True, help="path of the document to write")
+    parser.add_argument("--fanout", type=int, default=4, help="child elements of each element (default 4)")
+    parser.add_argument("--depth", type=int, default=4, help="levels of nested elements (default 4)")
+    parser.add_argument("--data-levels", type=int, default=1, help="levels of embedded data documents (default 1)")
+    parser.add_argument("--data-size", default="1KB", help="about how large embedded documents are (default 1KB)")
+    parser.add_argument("--attributes", type=int, default=4, help="most attributes on an element (default 4)")
+    parser.add_argument("--mix", default=None,
+                        help="weights of the attribute types, such as float=5,int=2,string=2,enum=1,bool=1")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the document (default 0)")
+    arguments = parser.parse_args(arguments)
+
+    mix = None
+    if arguments.mix:
+        mix = {kind: int(weight) for kind, weight in (item.split("=") for item in arguments.mix.split(","))}
+    text = generate(arguments.size, arguments.fanout, arguments.depth, arguments.data_levels, mix,
+                    arguments.attributes, arguments.data_size, arguments.seed)
+    with open(arguments.output, "w", encoding="utf-8", newline="\n") as document:
+        document.write(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""Benchmarks of deftree on documents shaped like those of a Defold project.
+
+    python benchmark_deftree.py                      run all benchmarks and print the results
+    python benchmark_deftree.py --save base.json     also store the results as a baseline
+    python benchmark_deftree.py --compare base.json  fail if a result is more than --threshold slower than the baseline
+    python benchmark_deftree.py --filter parse/ --profile  print where the time of the parse benchmarks goes
+    python benchmark_deftree.py --sweep 100MB        print, as CSV, how the time grows with documents from 1KB to 100MB
+
+Times are the fastest of --repeat runs with the garbage collector off, memory is the peak traced while parsing or
+serializing. A baseline is only comparable on the machine and Python version it was made with.
+"""
+import argparse
+import cProfile
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+for _path in (os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+              os.path.dirname(os.path.dirname(os.path.abspath(__file__)))):
+    if _path not in sys.path:
+        sys.path.append(_path)
+
+import deftree
+from document_generator import generate, nested_collection, particlefx, sweep, tilemap, wide_gui
+
+root_path = os.path.dirname(os.path.abspath(__file__))
+
+
+def documents(scale):
+    """Returns the name of each benchmarked document with a function making its text, scale multiplies their size"""
+    def profile():
+        with open(os.path.join(root_path, "profile.defold")) as document:
+            return document.read()
+
+    return [("profile_gui", profile),
+            ("wide_gui", lambda: wide_gui(int(1000 * scale))),
+            ("nested_collection", lambda: nested_collection(int(200 * scale), 8)),
+            ("tilemap", lambda: tilemap(int(64 * scale ** 0.5), int(64 * scale ** 0.5), 4)),
+            ("particlefx", lambda: particlefx(int(20 * scale), 32))]
+
+
+def timed(function, setup=None, repeat=5):
+    """Returns the fastest time of function, called with what setup returns which isn't timed"""
+    best = None
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            function(argument)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_memory(function):
+    """Returns the most memory allocated at once while function runs, in bytes"""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _read_values(root):
+    for attribute in root.iter_attributes():
+        attribute.value
+
+
+def _create_attributes(_):
+    element = deftree.Element("root")
+    for index in range(5000):
+        element.add_attribute("id", '"node{}"'.format(index))
+        element.add_attribute("x", index * 0.5)
+        element.add_attribute("tile", index)
+        element.add_attribute("type", "TYPE_BOX")
+        element.add_attribute("visible", True)
+
+
+def run(directory, scale=1.0, repeat=5, selected=None):
+    """Runs the benchmarks whose name contains selected, returns a dict of name to seconds or bytes"""
+    results = dict()
+
+    def add(name, measure):
+        if selected is None or selected in name:
+            results[name] = measure()
+            print("{:<36} {}".format(name, _format(name, results[name])))
+
+    kinds = ["parse", "serialize", "reserialize", "iterate", "values", "query", "copy", "memory/parse",
+             "memory/serialize"]
+    for name, make_text in documents(scale):
+        if selected is not None and not any(selected in "{}/{}".format(kind, name) for kind in kinds):
+            continue
+        path = os.path.join(directory, name + ".defold")
+        with open(path, "w", encoding="utf-8") as document:
+            document.write(make_text())
+
+        def parsed():
+            return deftree.parse(path).get_root()
+
+        add("parse/" + name, lambda: timed(lambda _: deftree.parse(path), repeat=repeat))
+        add("serialize/" + name, lambda: timed(deftree.to_string, parsed, repeat))
+        add("reserialize/" + name, lambda: timed(deftree.to_string, lambda: _serialized(parsed()), repeat))
+        add("iterate/" + name, lambda: timed(lambda root: sum(1 for _ in root.iter()), parsed, repeat))
+        add("values/" + name, lambda: timed(_read_values, parsed, repeat))
+        add("query/" + name, lambda: timed(lambda root: (root.findall("//position"), root.findall("*[id]"),
+                                                          root.find("//x")), parsed, repeat))
+        add("copy/" + name, lambda: timed(lambda root: root.copy(), parsed, repeat))
+        add("memory/parse/" + name, lambda: peak_memory(lambda: parsed()))
+        add("memory/serialize/" + name, lambda: _serialize_memory(parsed()))
+    add("create_attributes", lambda: timed(_create_attributes, repeat=repeat))
+    return results
+
+
+def run_sweep(directory, largest, repeat=5):
+    """Times parsing, serializing and reading the values of generated documents from 1KB up to largest, each four
+    times larger than the one before, and prints the seconds and the seconds per MB of each as CSV"""
+    print("size,parse,serialize,values,parse_per_mb,serialize_per_mb,values_per_mb")
+    path = os.path.join(directory, "sweep.defold")
+    for size in sweep(1024, largest):
+        with open(path, "w", encoding="utf-8") as document:
+            document.write(generate(size, seed=0))
+        size = os.path.getsize(path)
+        # Large documents take long enough that a single run is steady
+        runs = max(1, min(repeat, (8 * 1024 * 1024) // size))
+
+        def parsed():
+            return deftree.parse(path).get_root()
+
+        times = [timed(lambda _: deftree.parse(path), repeat=runs), timed(deftree.to_string, parsed, runs),
+                 timed(_read_values, parsed, runs)]
+        megabytes = size / 1024 / 1024
+        print(",".join([str(size)] + ["{:.6f}".format(value) for value in times] +
+                       ["{:.6f}".format(value / megabytes) for value in times]))
+
+
+def _serialized(root):
+    deftree.to_string(root)
+    return root
+
+
+def _serialize_memory(root):
+    return peak_memory(lambda: deftree.to_string(root))
+
+
+def _format(name, value):
+    if name.startswith("memory/"):
+        return "{:10.2f} MB".format(value / 1024 / 1024)
+    return "{:10.2f} ms".format(value * 1000)
+
+
+def compare(results, baseline, threshold):
+    """Prints how results compare with the baseline, returns the names of those more than threshold worse"""
+    regressions = []
+    print("{:<36} {:>13} {:>13} {:>8}".format("", "baseline", "current", "ratio"))
+    for name, value in results.items():
+        if name not in baseline["results"]:
+            continue
+        base = baseline["results"][name]
+        ratio = value / base if base else 1.0
+        regressed = ratio > 1.0 + threshold
+        if regressed:
+            regressions.append(name)
+        print("{:<36} {} {} {:7.2f}x{}".format(name, _format(name, base), _format(name, value), ratio,
+                                               "  REGRESSION" if regressed else ""))
+    return regressions
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--save", metavar="PATH", help="store the results as a baseline in PATH")
+    parser.add_argument("--compare", metavar="PATH", help="compare the results with the baseline in PATH")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="slowdown, as a fraction, over which a result is a regression (default 0.1)")
+    parser.add_argument("--repeat", type=int, default=5, help="times each benchmark is run (default 5)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the size of the documents")
+    parser.add_argument("--filter", help="only run the benchmarks whose name contains this")
+    parser.add_argument("--profile", action="store_true", help="print a profile of the benchmarks that were run")
+    parser.add_argument("--sweep", metavar="SIZE", help="time generated documents from 1KB up to SIZE instead")
+    arguments = parser.parse_args(arguments)
+
+    if arguments.sweep:
+        with tempfile.TemporaryDirectory() as directory:
+            run_sweep(directory, arguments.sweep, arguments.repeat)
+        return 0
+
+    profile = cProfile.Profile() if arguments.profile else None
+    with tempfile.TemporaryDirectory() as directory:
+        if profile:
+            profile.enable()
+        results = run(directory, arguments.scale, arguments.repeat, arguments.filter)
+        if profile:
+            profile.disable()
+            profile.print_stats("cumulative")
+
+    if arguments.save:
+        with open(arguments.save, "w") as baseline:
+            json.dump({"deftree": deftree.__version__, "python": platform.python_version(),
+                       "machine": platform.machine(), "scale": arguments.scale, "results": results},
+                      baseline, indent=2, sort_keys=True)
+
+    if arguments.compare:
+        with open(arguments.compare) as stored:
+            baseline = json.load(stored)
+        if baseline.get("scale") != arguments.scale:
+            print("The baseline was made with --scale {}".format(baseline.get("scale")))
+            return 2
+        print()
+        regressions = compare(results, baseline, arguments.threshold)
+        if regressions:
+            print("{} regressions over {:.0%}: {}".format(len(regressions), arguments.threshold,
+                                                          ", ".join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,12 @@
 import os
 import shutil
 import unittest
+from unittest import mock
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
 
 # hack the import
 import sys
@@ -8,6 +14,7 @@ if os.path.dirname(os.path.dirname(__file__)) not in sys.path:
     sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 import deftree
+import document_generator
 
 
 def is_valid(path):
@@ -64,6 +71,187 @@ class TestDefTreeParsing(unittest.TestCase):
         qualifiers.add_attribute("height", "720")
         self.assertTrue(deftree.validate(deftree.to_string(string_root), deftree.to_string(root)))
 
+    def test_parse_from_bytes(self):
+        import mmap
+        for name in ["embedded.defold", "nested.defold", "special_character.defold"]:
+            path = os.path.join(self.root_path, name)
+            with open(path, "rb") as document:
+                data = document.read()
+                with mmap.mmap(document.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    from_mmap = deftree.to_string(deftree.from_string(mapped).get_root())
+            text = data.decode("utf-8")
+            self.assertEqual(deftree.to_string(deftree.from_string(data).get_root()), text, name)
+            self.assertEqual(deftree.to_string(deftree.from_string(memoryview(data)).get_root()), text, name)
+            self.assertEqual(from_mmap, text, name)
+            self.assertEqual(deftree.to_string(deftree.from_string(data.replace(b"\n", b"\r\n")).get_root()), text)
+
+        root = deftree.from_string('a {\n  text: "é"\n  size: 1.5\n}\n'.encode("utf-8")).get_root()
+        element = root.get_element("a")
+        self.assertEqual(element.get_attribute("text").value, "é")
+        self.assertEqual(element.get_attribute("size").value, 1.5)
+        with self.assertRaises(deftree.ParseError):
+            deftree.from_string(b"a {\n" + b"x" * 30)
+
+    def test_compare(self):
+        import io
+        paths = [os.path.join(self.root_path, name) for name in ["embedded.defold", "nested.defold",
+                                                                  "special_character.defold", "not_a_valid.defold"]]
+        paths.append(os.path.join(self.root_path, "_copy", "indented.defold"))
+        with open(paths[-1], "w") as document:
+            document.write("a {\n b: 1\n}\n")
+        # Values are compared as they are written once read
+        paths.append(os.path.join(self.root_path, "_copy", "trailing_zero.defold"))
+        with open(paths[-1], "w") as document:
+            document.write('a {\n  data: "b {\\n"\n  "  x: 1.50\\n"\n  "}\\n"\n  ""\n}\n')
+        for workers in [1, 2]:
+            results = list(deftree.compare_many(paths, workers=workers))
+            self.assertEqual([path for path, _ in results], paths)
+            results = dict(results)
+            self.assertEqual([results[path] for path in paths[:3]], [None, None, None])
+            self.assertIsInstance(results[paths[3]], deftree.ParseError)
+            difference = results[paths[4]]
+            self.assertEqual((difference.line, difference.column, difference.path), (2, 2, "a/b"))
+            self.assertEqual(difference.node.name, "b")
+            difference = results[paths[5]]
+            self.assertEqual((difference.line, difference.column, difference.path), (3, 12, "a/data"))
+        self.assertCountEqual(dict(deftree.compare_many(paths, workers=2, ordered=False)), paths)
+        self.assertIsNone(deftree.compare(deftree.parse(paths[0])))
+
+        document = b'a {\n  b {\n    c: 1\n    d: "\xc3\xa9x"\n  }\n  e: 2\n}\nf: 3\n'
+        tree = deftree.from_string(document)
+        self.assertIsNone(deftree.compare(tree, io.BytesIO(document), buffer_size=3))
+        difference = deftree.compare(tree, io.BytesIO(document.replace(b"x", b"y")), buffer_size=3)
+        self.assertEqual((difference.line, difference.column, difference.path), (4, 10, "a/b/d"))
+        self.assertIs(difference.node, tree.get_root().get_element("a").get_element("b").get_attribute("d"))
+        difference = deftree.compare(tree.get_root(), io.BytesIO(document.replace(b"  }", b" }")))
+        self.assertEqual((difference.line, difference.column, difference.path), (5, 2, "a/b"))
+        difference = deftree.compare(tree, io.BytesIO(document[:-2]))
+        self.assertEqual((difference.line, difference.column, difference.path), (8, 4, "f"))
+        difference = deftree.compare(tree, io.BytesIO(document + b"g: 4\n"))
+        self.assertEqual((difference.line, difference.column, difference.node), (9, 1, None))
+
+        document = b"a {\n  x: 1.50\n}\n"
+        difference = deftree.compare(deftree.from_string(document), io.BytesIO(document))
+        self.assertEqual((difference.line, difference.column, difference.path), (2, 9, "a/x"))
+
+    def test_stats(self):
+        path = os.path.join(self.root_path, "nested.defold")
+        parse, build_node = deftree._DefParser._parse, deftree._DefParser._build_node
+        resolve = deftree._DeferredAttribute._resolve
+        with deftree.stats() as outer:
+            with deftree.stats() as counters:
+                tree = deftree.parse(path)
+            self.assertEqual((counters.documents, counters.elements, counters.attributes, counters.tokens),
+                             (1, 5, 13, 22))
+            self.assertEqual((counters.embedded_documents, counters.deferred_documents), (0, 1))
+            self.assertEqual(counters.bytes_parsed, os.path.getsize(path))
+            self.assertGreater(counters.parse_time, 0)
+
+            text = deftree.to_string(tree.get_root())
+            self.assertEqual(counters.characters_serialized, 0)
+            self.assertEqual(outer.characters_serialized, len(text))
+            for attribute in tree.get_root().iter_attributes():
+                attribute.value
+            self.assertEqual((outer.documents, outer.embedded_documents, outer.attributes_inferred), (3, 2, 26))
+            self.assertGreater(outer.decode_time, 0)
+            self.assertEqual(outer.as_dict()["tokens"], 42)
+
+        # Only the tokens of the document are counted when it is parsed into a tree that has children
+        with deftree.stats() as counters:
+            tree.from_string("e: 1\n")
+            self.assertEqual((counters.tokens, counters.elements, counters.attributes), (1, 0, 1))
+            chunks = deftree._DefParser._iter_serialize(tree.get_root())
+            first = next(chunks)
+            self.assertEqual(counters.characters_serialized, len(first))
+        self.assertIs(deftree._DefParser._parse, parse)
+        self.assertIs(deftree._DefParser._build_node, build_node)
+        self.assertIs(deftree._DeferredAttribute._resolve, resolve)
+
+    def test_to_stream(self):
+        import io
+        for name in ["embedded.defold", "nested.defold", "special_character.defold"]:
+            path = os.path.join(self.root_path, name)
+            stream = io.StringIO()
+            deftree.to_stream(deftree.parse(path).get_root(), stream)
+            self.assertTrue(deftree.validate(stream.getvalue(), path), name)
+
+    def test_serialize_sub_element(self):
+        string_doc = """a {\n  b {\n    c: 1\n  }\n  d: 2\n}\n"""
+        root = deftree.from_string(string_doc).get_root()
+        self.assertEqual(deftree.to_string(root.get_element("a")), """b {\n  c: 1\n}\nd: 2\n""")
+
+    def test_parse_many(self):
+        names = ["embedded.defold", "not_a_valid.defold", "nested.defold", "missing.defold", "simple.defold",
+                 "special_character.defold"]
+        paths = [os.path.join(self.root_path, name) for name in names]
+        for workers in [1, 2]:
+            results = list(deftree.parse_many(paths, workers=workers))
+            self.assertEqual([path for path, _ in results], paths)
+            self.assertIsInstance(results[1][1], deftree.ParseError)
+            self.assertIsInstance(results[3][1], OSError)
+            for path, tree in results[0:1] + results[2:3] + results[4:]:
+                self.assertEqual(tree.get_document_path(), path)
+                self.assertTrue(deftree.validate(deftree.to_string(tree.get_root()), path), path)
+
+        results = dict(deftree.parse_many(paths, workers=2, ordered=False))
+        self.assertCountEqual(results, paths)
+        material = results[paths[2]].get_root().find("embedded_instances/data//material")
+        self.assertEqual(material.value, "/builtins/materials/sprite.material")
+
+    def test_parse_with_cache(self):
+        cache_path = os.path.join(self.root_path, "_copy", "cache")
+        path = os.path.join(self.root_path, "_copy", "cached.defold")
+        shutil.copy(os.path.join(self.root_path, "nested.defold"), path)
+        cache = deftree.ParseCache(cache_path)
+
+        tree = deftree.parse(path, cache=cache)
+        self.assertTrue(deftree.validate(deftree.to_string(tree.get_root()), path))
+        self.assertEqual(len(os.listdir(cache_path)), 1)
+
+        with mock.patch.object(deftree._DefParser, "_parse") as parse:
+            cached_tree = deftree.parse(path, cache=cache_path)
+            # A new modification time with the same content still uses the cache
+            os.utime(path, ns=(0, 0))
+            deftree.parse(path, cache=cache)
+            parse.assert_not_called()
+        # Storing the new time replaces the entry, its size is not counted twice
+        self.assertEqual(cache._size, sum(os.path.getsize(os.path.join(cache_path, name))
+                                          for name in os.listdir(cache_path)))
+        # A cache given as a path is the same for every call, it does not scan the directory each time
+        self.assertIs(deftree.ParseCache._for_directory(cache_path),
+                      deftree.ParseCache._for_directory(os.path.join(cache_path, ".")))
+        self.assertTrue(deftree.validate(deftree.to_string(cached_tree.get_root()), path))
+        self.assertEqual(cached_tree.get_document_path(), path)
+        material = cached_tree.get_root().find("embedded_instances/data//material")
+        self.assertEqual(material.value, "/builtins/materials/sprite.material")
+
+        with open(path, "a") as document:
+            document.write('extra: "value"\n')
+        tree = deftree.parse(path, cache=cache)
+        self.assertEqual(tree.get_root().get_attribute("extra").value, "value")
+        self.assertEqual(deftree.parse(path, cache=cache).get_root().get_attribute("extra").value, "value")
+        with mock.patch.object(deftree._DefParser, "_parse") as parse:
+            tree = deftree.parse(os.fsencode(path), cache=cache)
+            parse.assert_not_called()
+        self.assertEqual(tree.get_root().get_attribute("extra").value, "value")
+        self.assertEqual(tree.get_document_path(), os.fsencode(path))
+
+        # A broken cache entry is parsed again
+        entry = os.path.join(cache_path, os.listdir(cache_path)[0])
+        with open(entry, "wb") as broken:
+            broken.write(b"broken")
+        self.assertEqual(deftree.parse(path, cache=cache).get_root().get_attribute("extra").value, "value")
+
+        # The least recently used entries are removed when the cache grows too large
+        size = os.path.getsize(entry)
+        cache = deftree.ParseCache(cache_path, max_size=size + size // 2)
+        os.utime(entry, ns=(0, 0))
+        deftree.parse(os.path.join(self.root_path, "embedded.defold"), cache=cache)
+        self.assertEqual(len(os.listdir(cache_path)), 1)
+        self.assertFalse(os.path.exists(entry))
+        cache.clear()
+        self.assertEqual(os.listdir(cache_path), [])
+
     def test_writing_with_changed_attribute(self):
         path = os.path.join(self.root_path, "simple.defold")
         output_path = os.path.join(self.root_path, "_copy", "edit.defold")
@@ -93,6 +281,55 @@ class TestDefTreeParsing(unittest.TestCase):
         attribute = a.get_attribute("fps")
         self.assertTrue(attribute.value == test_value)
 
+    def test_writing_unchanged_document(self):
+        path = os.path.join(self.root_path, "_copy", "unchanged.defold")
+        shutil.copy(os.path.join(self.root_path, "nested.defold"), path)
+        os.chmod(path, 0o640)
+        os.utime(path, ns=(0, 0))
+        tree = deftree.parse(path)
+
+        self.assertFalse(tree.write(skip_unchanged=True))
+        self.assertEqual(os.stat(path).st_mtime_ns, 0)
+
+        # Compared with the content of a file that wasn't parsed
+        other_path = os.path.join(self.root_path, "_copy", "unchanged_other.defold")
+        shutil.copy(path, other_path)
+        os.utime(other_path, ns=(0, 0))
+        self.assertFalse(tree.write(other_path, skip_unchanged=True))
+        self.assertEqual(os.stat(other_path).st_mtime_ns, 0)
+
+        tree.get_root().get_element("embedded_instances").set_attribute("id", "changed")
+        self.assertTrue(tree.write(skip_unchanged=True))
+        self.assertNotEqual(os.stat(path).st_mtime_ns, 0)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+        self.assertTrue(deftree.validate(deftree.to_string(tree.get_root()), path))
+        os.utime(path, ns=(0, 0))
+        self.assertFalse(tree.write(skip_unchanged=True))
+
+        self.assertTrue(tree.write())
+        self.assertNotEqual(os.stat(path).st_mtime_ns, 0)
+        self.assertEqual([name for name in os.listdir(os.path.dirname(path)) if name.endswith(".tmp")], [])
+
+    def test_writing_document_with_crlf(self):
+        path = os.path.join(self.root_path, "_copy", "crlf.defold")
+        with open(os.path.join(self.root_path, "nested.defold"), "rb") as document:
+            text = document.read()
+        for parsed in [True, False]:
+            with open(path, "wb") as document:
+                document.write(text.replace(b"\n", b"\r\n"))
+            os.utime(path, ns=(0, 0))
+            tree = deftree.parse(path) if parsed else deftree.from_string(text)
+            # The file is always written with LF line endings, so one with CRLF is not the same
+            self.assertTrue(tree.write(path, skip_unchanged=True))
+            with open(path, "rb") as document:
+                self.assertEqual(document.read(), text)
+            os.utime(path, ns=(0, 0))
+            self.assertFalse(tree.write(path, skip_unchanged=True))
+            self.assertEqual(os.stat(path).st_mtime_ns, 0)
+            self.assertTrue(tree.write(path))
+            with open(path, "rb") as document:
+                self.assertEqual(document.read(), text)
+
 
 class TestDefTreeDisk(unittest.TestCase):
     root_path = os.path.join(os.path.dirname(__file__), "data")
@@ -321,6 +558,187 @@ class TestDefTreeElement(unittest.TestCase):
         self.assertTrue(len(root) == 1)
 
 
+    def test_copy_into_parent(self):
+        root = deftree.parse(os.path.join(os.path.dirname(__file__), "data", "nested.defold")).get_root()
+        instance = root.get_element("embedded_instances")
+        copy = instance.copy()
+        self.assertIsNone(copy.get_parent())
+        self.assertEqual(deftree.to_string(copy), deftree.to_string(instance))
+
+        target = deftree.Element("target")
+        copy = instance.copy(target)
+        self.assertIs(copy.get_parent(), target)
+        self.assertEqual(list(target), [copy])
+        self.assertTrue(all(child.get_parent() is copy for child in copy))
+
+        copy.get_attribute("id").value = "copy"
+        copy.find("data//material").value = "/main/my.material"
+        self.assertEqual(instance.get_attribute("id").value, "go")
+        self.assertEqual(instance.find("data//material").value, "/builtins/materials/sprite.material")
+        self.assertIn("my.material", deftree.to_string(target))
+
+    def test_child_positions(self):
+        root = deftree.Element("root")
+        children = [root.add_element("child{}".format(i)) for i in range(100)]
+        self.assertEqual([root.index(child) for child in children], list(range(100)))
+        for child in children[10:60:3]:
+            root.remove(child)
+        root.insert(5, deftree.Element("inserted"))
+        root.insert(-1, deftree.Element("inserted"))
+        del root[0]
+        root[1] = deftree.Element("replaced")
+        self.assertEqual([root.index(child) for child in root], list(range(len(root))))
+        with self.assertRaises(ValueError):
+            root.index(children[10])
+        root.remove(children[10])
+        self.assertEqual(len(root), 84)
+
+    def test_batch_mutations(self):
+        root = deftree.DefTree().get_root()
+        root.extend(deftree.Element("nodes") for _ in range(20))
+        for i, node in enumerate(root):
+            node.add_attribute("id", "node{}".format(i))
+        self.assertTrue(all(node.get_parent() is root for node in root))
+        self.assertEqual(len(root.findall("nodes")), 20)
+
+        removed = root.remove_all(lambda node: int(node.get_attribute("id").value[4:]) % 2)
+        self.assertEqual(len(removed), 10)
+        self.assertEqual([node.get_attribute("id").value for node in root],
+                         ["node{}".format(i) for i in range(0, 20, 2)])
+        self.assertEqual(root.index(root[4]), 4)
+        self.assertEqual(len(root.findall("nodes")), 10)
+
+        kept = root[0]
+        root.replace_children([deftree.Element("other"), kept])
+        self.assertEqual(deftree.to_string(root), 'other {\n}\nnodes {\n  id: "node0"\n}\n')
+        self.assertEqual(root.index(kept), 1)
+        self.assertIsNone(root.find("nodes[id='node2']"))
+        with self.assertRaises(TypeError):
+            root.extend(["nodes"])
+
+    def test_update_attributes(self):
+        string_doc = TestDefTreeFind.string_doc
+        root = deftree.from_string(string_doc).get_root()
+        changed = root.update_attributes(("texture", "font"), value=lambda path: path.replace("atlas/", "images/"))
+        self.assertEqual(changed, 2)
+        self.assertEqual([texture.value for texture in root.iter_attributes("texture")], ["images/a", "images/b"])
+        self.assertEqual(root.update_attributes("texture", value=lambda path: path), 0)
+
+        changed = root.update_attributes("x", where=lambda x: x.get_parent().get_parent().get_attribute("type") ==
+                                         "TYPE_TEXT", value=lambda x: x * 2)
+        self.assertEqual(changed, 1)
+        self.assertEqual([x.value for x in root.iter_attributes("x")], [1.0, 4.0])
+        self.assertIs(type(root.find("nodes/position/x")), deftree.DefTreeFloat)
+
+        self.assertEqual(root.update_attributes("id", value="same"), 2)
+        self.assertEqual(root.update_attributes(value=0, where=lambda attribute: attribute.name == "x"), 2)
+        self.assertEqual([type(x) for x in root.iter_attributes("x")], [deftree.DefTreeFloat, deftree.DefTreeFloat])
+        self.assertEqual(deftree.to_string(root), string_doc.replace("atlas", "images").replace('"box"', '"same"')
+                         .replace('"btn"', '"same"').replace("1.0", "0.0").replace("2.0", "0.0"))
+
+    def test_update_attributes_keeps_types(self):
+        string_doc = 'a {\n  id: "node"\n  x: 1.5\n  layer: 3\n  type: TYPE_BOX\n}\n'
+
+        def updated(**kwargs):
+            root = deftree.from_string(string_doc).get_root()
+            changed = root.update_attributes(**kwargs)
+            return changed, deftree.to_string(root)
+
+        def assigned(name, update):
+            root = deftree.from_string(string_doc).get_root()
+            for attribute in root.iter_attributes(name):
+                attribute.value = update(attribute.value)
+            return deftree.to_string(root)
+
+        for name, update, text in [("id", lambda _: "5", '  id: "5"\n'), ("x", round, "  x: 2.0\n"),
+                                   ("layer", lambda layer: layer * 1.5, "  layer: 4\n"),
+                                   ("type", lambda _: "TYPE_TEXT", "  type: TYPE_TEXT\n")]:
+            changed, result = updated(name=name, value=update)
+            self.assertEqual(changed, 1, name)
+            self.assertIn(text, result, name)
+            self.assertEqual(result, assigned(name, update), name)
+
+        root = deftree.from_string(string_doc).get_root()
+        with self.assertRaises(ValueError):
+            root.update_attributes(("layer", "type"), value=lambda value: "invalid" if value == "TYPE_BOX" else 4)
+        self.assertEqual(deftree.to_string(root), string_doc)
+        self.assertEqual(updated(name="x", value=1.5), (0, string_doc))
+
+    def test_element_subclass(self):
+        class MyElement(deftree.Element):
+            def __init__(self, name):
+                super(MyElement, self).__init__(name)
+                self.extra = True
+
+        root = MyElement("root")
+        child = root.add_element("child")
+        self.assertIsInstance(child, MyElement)
+        self.assertTrue(child.extra)
+        child.add_attribute("id", "child")
+        self.assertEqual(deftree.to_string(root), 'child {\n  id: "child"\n}\n')
+
+    def test_nodes_have_no_dict(self):
+        root = deftree.DefTree().get_root()
+        self.assertFalse(hasattr(root, "__dict__"))
+        for value in [1, 1.0, "string", "ENUM", True]:
+            self.assertFalse(hasattr(root.add_attribute("attribute", value), "__dict__"))
+
+
+    def test_named_lookups_on_wide_element(self):
+        root = deftree.DefTree().get_root()
+        for i in range(40):
+            if i % 2:
+                root.add_attribute("attribute{}".format(i % 5), i)
+            else:
+                root.add_element("element{}".format(i % 5))
+        root.get_element("element0")
+        self.assertIsNone(root._index)
+        for i in range(deftree.Element._index_threshold):
+            root.add_attribute("filler", i)
+        root.add_element("single")
+
+        def check():
+            for i in range(5):
+                for name in ["attribute{}".format(i), "element{}".format(i), "single"]:
+                    expected_attributes = [c for c in root if deftree.is_attribute(c) and c.name == name]
+                    expected_elements = [c for c in root if deftree.is_element(c) and c.name == name]
+                    self.assertEqual(list(root.attributes(name)), expected_attributes)
+                    self.assertEqual(list(root.elements(name)), expected_elements)
+                    self.assertIs(root.get_attribute(name), (expected_attributes or [None])[0])
+                    self.assertIs(root.get_element(name), (expected_elements or [None])[0])
+
+        check()
+        index = root._index
+        self.assertIsNotNone(index)
+        root.append(deftree.Element("element1"))
+        check()
+        root.insert(0, deftree.Element("element1"))
+        check()
+        root.insert(-5, deftree.Element("element0"))
+        check()
+        root.remove(root.get_attribute("attribute1"))
+        check()
+        root[3] = deftree.Element("element2")
+        check()
+        root[-1] = deftree.Element("single")
+        check()
+        del root[4]
+        check()
+        # Editing and looking up in turns keeps the same index instead of building it again
+        for i in range(100):
+            root.insert(i * 3, deftree.Element("element{}".format(i % 5)))
+            root.get_element("element2")
+            root.remove(root[i * 2])
+            root.get_attribute("attribute3")
+        check()
+        self.assertIs(root._index, index)
+        root.get_element("element3").name = "element4"
+        root.get_attribute("attribute3").name = "attribute4"
+        check()
+        self.assertIsNone(root.get_attribute("attribute1", 100))
+        self.assertEqual(root.get_attribute("attribute1", 11).value, 11)
+
+
 class TestDefTreeAttributes(unittest.TestCase):
     def test_getting_missing_attribute(self):
         tree = deftree.DefTree()
@@ -572,12 +990,558 @@ class TestDefTreeAttributes(unittest.TestCase):
         self.assertTrue(deftree.validate(deftree.to_string(string_root), string_doc))
 
 
+class TestDefTreeEmbeddedData(unittest.TestCase):
+    root_path = os.path.join(os.path.dirname(__file__), "data")
+
+    def test_embedded_data_is_parsed_on_access(self):
+        tree = deftree.parse(os.path.join(self.root_path, "nested.defold"))
+        data = tree.get_root().get_element("embedded_instances").get_element("data")
+        self.assertIsNotNone(data._embedded_source)
+        components = data.get_element("embedded_components")
+        self.assertIsNone(data._embedded_source)
+        self.assertTrue(components.get_attribute("id") == "sprite")
+        self.assertIsNotNone(components.get_element("data")._embedded_source)
+
+    def test_moving_unparsed_embedded_data(self):
+        path = os.path.join(self.root_path, "nested.defold")
+        texts = []
+        for lazy_data in [True, False]:
+            tree = deftree.DefTree()
+            tree._parser = deftree._DefParser(tree.get_root(), lazy_data=lazy_data)
+            root = tree._parser.parse(path)
+            components = root.get_element("embedded_instances").get_element("data").get_element("embedded_components")
+            data = components.get_element("data")
+            self.assertEqual(data._embedded_source is not None, lazy_data)
+            components.remove(data)
+            root.append(data)
+            texts.append(deftree.to_string(root))
+        self.assertEqual(texts[0], texts[1])
+        self.assertIn('data: "tile_set: \\"\\"\\n"\n  "default_animation', texts[0])
+
+    def test_embedded_data_edit(self):
+        path = os.path.join(self.root_path, "nested.defold")
+        tree = deftree.parse(path)
+        data = tree.get_root().get_element("embedded_instances").get_element("data")
+        position = data.get_element("embedded_components").get_element("position")
+        position.set_attribute("x", 3)
+        with open(path, "r") as document:
+            expected = document.read().replace('"    x: -5\\n"', '"    x: 3\\n"')
+        self.assertTrue(deftree.validate(deftree.to_string(tree.get_root()), expected))
+
+    def test_serializing_embedded_data_leaves_tree_untouched(self):
+        path = os.path.join(self.root_path, "nested.defold")
+        root = deftree.parse(path).get_root()
+        nodes = list(root.iter())
+        data = [node for node in nodes if node.name == "data"]
+        self.assertEqual(len(data), 2)
+        first = deftree.to_string(root)
+        self.assertEqual(list(root.iter()), nodes)
+        self.assertTrue(all(deftree.is_element(node) for node in data))
+        self.assertEqual(deftree.to_string(root), first)
+        self.assertTrue(deftree.validate(first, path))
+
+    def test_concurrent_serialization(self):
+        from concurrent.futures import ThreadPoolExecutor
+        path = os.path.join(self.root_path, "nested.defold")
+        root = deftree.parse(path).get_root()
+        list(root.iter())
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(deftree.to_string, [root] * 64))
+        self.assertTrue(all(deftree.validate(result, path) for result in results))
+
+    def test_embedded_data_special_characters(self):
+        root = deftree.DefTree().get_root()
+        data = root.add_element("embedded_components").add_element("data")
+        data.add_attribute("text", '"it\'s \\"é\\" \\342\\222\\266"')
+        nested = data.add_element("embedded_components").add_element("data")
+        nested.add_attribute("text", '"tab\tå"')
+        text = deftree.to_string(root)
+        self.assertIn('\\303\\251', text)
+        self.assertIn('\\\\342', text)
+        self.assertTrue(all(ord(character) < 128 for character in text))
+
+        parsed = deftree.from_string(text).get_root()
+        parsed_data = parsed.get_element("embedded_components").get_element("data")
+        self.assertEqual(parsed_data.get_attribute("text").value, data.get_attribute("text").value)
+        parsed_nested = parsed_data.get_element("embedded_components").get_element("data")
+        self.assertEqual(parsed_nested.get_attribute("text").value, "tab\tå")
+        self.assertEqual(deftree.to_string(parsed), text)
+
+
+class TestDefTreeSerializationCache(unittest.TestCase):
+    root_path = os.path.join(os.path.dirname(__file__), "data")
+
+    def assertSerializedAsNew(self, root):
+        cached = deftree.to_string(root)
+        for element in root.iter_elements():
+            element._text = None
+        self.assertEqual(cached, deftree.to_string(root))
+
+    def test_unchanged_elements_are_reused(self):
+        root = deftree.parse(os.path.join(self.root_path, "nested.defold")).get_root()
+        first = deftree.to_string(root)
+        instance = root.get_element("embedded_instances")
+        position = instance.get_element("position")
+        segments = position._text[2]
+        self.assertEqual(segments, ["  position {\n    x: 10.0\n    y: 0.15\n    z: 4.1751063E-15\n  }\n"])
+        kept = instance._text
+        self.assertIn(position, kept[2])
+        root.add_attribute("scale_along_z", 0)
+        self.assertEqual(deftree.to_string(root), first + "scale_along_z: 0\n")
+        self.assertIs(position._text[2], segments)
+        self.assertIs(instance._text, kept)
+
+        # Each line is kept once, by the element that writes it
+        def kept_size():
+            return sum(len(segment) for element in root.iter_elements() if element._text
+                       for segment in element._text[2] if isinstance(segment, str))
+        data = instance.get_element("data")
+        self.assertIsNotNone(data._text)
+        self.assertLessEqual(kept_size(), len(first) + len("scale_along_z: 0\n"))
+        # Walking the tree parsed the embedded document
+        self.assertIsNone(data._text)
+
+        # A change only drops the text of the element that changed, not of its ancestors
+        material = data.find("embedded_components/data/material")
+        first = deftree.to_string(root)
+        component = data.get_element("embedded_components")
+        kept = component._text
+        material.value = "/main/my.material"
+        self.assertIsNone(material.get_parent()._text)
+        self.assertIs(component._text, kept)
+        self.assertEqual(deftree.to_string(root), first.replace("/builtins/materials/sprite.material",
+                                                                "/main/my.material"))
+        self.assertLessEqual(kept_size(), len(first))
+
+    def test_serializing_in_chunks(self):
+        root = deftree.from_string(document_generator.tilemap(32, 32, 1)).get_root()
+        text = deftree.to_string(root)
+        chunks = list(deftree._DefParser._iter_serialize(root))
+        self.assertEqual("".join(chunks), text)
+        # The one layer holding all the cells is written a cell at a time
+        self.assertLess(max(len(chunk) for chunk in chunks), 100)
+
+    def test_changes_are_serialized(self):
+        root = deftree.parse(os.path.join(self.root_path, "nested.defold")).get_root()
+        instance = root.get_element("embedded_instances")
+        data = instance.get_element("data")
+        deftree.to_string(root)
+
+        material = root.find("embedded_instances/data//material")
+        self.assertSerializedAsNew(root)
+        material.value = "/main/my.material"
+        self.assertIn("my.material", deftree.to_string(root))
+        self.assertSerializedAsNew(root)
+        material.name = "other_material"
+        self.assertSerializedAsNew(root)
+
+        data.append(deftree.Element("appended"))
+        self.assertSerializedAsNew(root)
+        position = instance.get_element("position")
+        instance.insert(0, deftree.Element("inserted"))
+        self.assertSerializedAsNew(root)
+        instance.remove(position)
+        self.assertSerializedAsNew(root)
+        instance[0] = deftree.Element("replaced")
+        self.assertSerializedAsNew(root)
+        instance.get_element("replaced").clear()
+        self.assertSerializedAsNew(root)
+        instance.name = "renamed"
+        self.assertSerializedAsNew(root)
+
+        # A resolved value that is written differently is written the new way
+        root = deftree.from_string("a {\n  x: 1.50\n}\n").get_root()
+        self.assertEqual(deftree.to_string(root), "a {\n  x: 1.50\n}\n")
+        self.assertEqual(root.find("a/x").value, 1.5)
+        self.assertEqual(deftree.to_string(root), "a {\n  x: 1.5\n}\n")
+
+
+class TestDefTreeThreads(unittest.TestCase):
+    root_path = os.path.join(os.path.dirname(__file__), "data")
+
+    @classmethod
+    def setUpClass(cls):
+        os.makedirs(os.path.join(cls.root_path, "_threads"), exist_ok=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(os.path.join(cls.root_path, "_threads"))
+
+    def setUp(self):
+        # Switching threads as often as possible makes races show up, with or without the GIL
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        sys.setswitchinterval(self.switch_interval)
+
+    def run_in_threads(self, function, arguments, workers=8):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(workers) as pool:
+            return list(pool.map(function, arguments))
+
+    def test_independent_trees_from_threads(self):
+        paths = []
+        for seed in range(32):
+            path = os.path.join(self.root_path, "_threads", "document{}.defold".format(seed))
+            with open(path, "w", encoding="utf-8") as document:
+                document.write(document_generator.generate("8KB", data_levels=2, seed=seed))
+            paths.append(path)
+        cache = deftree.ParseCache(os.path.join(self.root_path, "_threads", "cache"))
+
+        def work(path):
+            with open(path, encoding="utf-8") as document:
+                text = document.read()
+            tree = deftree.parse(path, cache=cache if paths.index(path) % 2 else None)
+            root = tree.get_root()
+            self.assertEqual(tree.get_document_path(), path)
+            self.assertEqual(deftree.to_string(root), text)
+            tree.build_index()
+            attribute = next(root.iter_attributes())
+            attribute.value = attribute.value
+            self.assertTrue(tree.lookup(attribute.name))
+            list(root.iter())
+            output_path = path + ".out"
+            tree.write(output_path)
+            self.assertIsNone(deftree.compare(tree, output_path))
+            tree.drop_index()
+            return deftree.from_string(text.encode("utf-8")).get_root().name
+
+        for _ in range(2):
+            self.assertEqual(self.run_in_threads(work, paths), ["root"] * len(paths))
+        import gc
+        gc.collect()
+        self.assertEqual(deftree._TreeIndex.count, 0)
+
+    def test_reading_shared_tree_from_threads(self):
+        from threading import Barrier
+        text = document_generator.generate("64KB", data_levels=3, seed=1)
+        expected_root = deftree.from_string(text).get_root()
+        expected = (len(expected_root.findall("//data//*")), deftree.to_string(expected_root))
+        for _ in range(4):
+            root = deftree.from_string(text).get_root()
+            barrier = Barrier(8)
+
+            def read(_):
+                barrier.wait()
+                return len(root.findall("//data//*")), deftree.to_string(root)
+
+            self.assertEqual(self.run_in_threads(read, range(8)), [expected] * 8)
+
+
+class TestDefTreeGeneratedDocuments(unittest.TestCase):
+    def test_generated_documents_round_trip(self):
+        for size in document_generator.sweep(1024, "256KB"):
+            text = document_generator.generate(size, fanout=3, depth=5, data_levels=2, seed=size)
+            self.assertLess(abs(len(text) - size), max(size // 2, 1024))
+            root = deftree.from_string(text).get_root()
+            self.assertEqual(deftree.to_string(root), text)
+            for attribute in root.iter_attributes():
+                attribute.value
+            self.assertEqual(deftree.to_string(root), text)
+
+    def test_generated_documents_are_reproducible(self):
+        self.assertEqual(document_generator.generate("8KB", seed=3), document_generator.generate(8192, seed=3))
+        self.assertNotEqual(document_generator.generate("8KB", seed=3), document_generator.generate("8KB", seed=4))
+
+    def test_generated_document_shape(self):
+        text = document_generator.generate("32KB", fanout=2, depth=3, data_levels=3, mix={"int": 1}, seed=1)
+        root = deftree.from_string(text).get_root()
+
+        def depth(element):
+            children = [child for child in element.elements() if child.name != "data"]
+            self.assertLessEqual(len(children), 2)
+            return 1 + max([depth(child) for child in children], default=0)
+        self.assertEqual(max(depth(element) for element in root.elements()), 3)
+        self.assertTrue(all(isinstance(attribute, deftree.DefTreeInt) for attribute in root.iter_attributes()
+                            if attribute.name != "data"))
+        nested = root
+        for _ in range(3):
+            nested = nested.find("//data")
+            self.assertIsNotNone(nested)
+        self.assertIsNone(nested.find("//data"))
+
+        for text in [document_generator.wide_gui(20), document_generator.nested_collection(10, 4),
+                     document_generator.tilemap(8, 8, 2), document_generator.particlefx(2, 4)]:
+            self.assertEqual(deftree.to_string(deftree.from_string(text).get_root()), text)
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class TestDefTreeArrays(unittest.TestCase):
+    string_doc = """nodes {\n  position {\n    x: 1.0\n    y: 2\n  }\n}
+nodes {\n  position {\n    x: -3.5\n    y: 4\n  }\n}\nnodes {\n  id: "no position"\n}\n"""
+
+    def test_to_arrays(self):
+        root = deftree.from_string(self.string_doc).get_root()
+        handle, arrays = root.to_arrays(["nodes/position/x", "nodes/position/y", "//y", "nodes/missing"])
+        self.assertEqual(arrays["nodes/position/x"].tolist(), [1.0, -3.5])
+        self.assertEqual(arrays["nodes/position/y"].tolist(), [2.0, 4.0])
+        self.assertEqual(arrays["//y"].tolist(), [2.0, 4.0])
+        self.assertEqual(arrays["nodes/missing"].tolist(), [])
+        self.assertEqual(deftree.to_string(root), self.string_doc)
+        with self.assertRaises(ValueError):
+            root.to_arrays(["nodes/id"])
+        root.find("nodes/id").value = "1.0"
+        with self.assertRaises(ValueError):
+            root.to_arrays(["//id"])
+
+    def test_from_arrays(self):
+        root = deftree.from_string(self.string_doc).get_root()
+        handle, arrays = root.to_arrays(["nodes/position/x", "nodes/position/y"])
+        arrays["nodes/position/x"] *= 2
+        arrays["nodes/position/y"] += numpy.array([0.0, 1.5])
+        self.assertEqual(root.from_arrays(handle, arrays), 3)
+        self.assertEqual([x.value for x in root.iter_attributes("x")], [2.0, -7.0])
+        self.assertEqual([y.value for y in root.iter_attributes("y")], [2, 5])
+        self.assertEqual([type(y) for y in root.iter_attributes("y")], [deftree.DefTreeInt, deftree.DefTreeInt])
+        self.assertIn("x: -7.0\n    y: 5\n", deftree.to_string(root))
+        self.assertEqual(root.from_arrays(handle, arrays), 0)
+        with self.assertRaises(ValueError):
+            root.from_arrays(handle, {"nodes/position/x": [1.0]})
+
+
+class TestDefTreeIterParse(unittest.TestCase):
+    root_path = os.path.join(os.path.dirname(__file__), "data")
+
+    def test_iterparse_builds_same_tree(self):
+        import io
+        for name in ["embedded.defold", "nested.defold", "simple.defold", "special_character.defold"]:
+            path = os.path.join(self.root_path, name)
+            with open(path, "rb") as document:
+                data = document.read()
+            for chunk_size in [1, 7, 65536]:
+                for mode, source in [("r", None), ("rb", None), ("rb", io.BytesIO(data.replace(b"\n", b"\r\n")))]:
+                    with source or open(path, mode) as document:
+                        events = deftree.iterparse(document, ("start",), chunk_size)
+                        _, element = next(events)
+                        for _ in events:
+                            pass
+                    root = element
+                    while root.get_parent():
+                        root = root.get_parent()
+                    self.assertTrue(deftree.validate(deftree.to_string(root), path), (name, mode, chunk_size))
+
+    def test_iterparse_events(self):
+        path = os.path.join(self.root_path, "embedded.defold")
+        events = [(event, node.name) for event, node in deftree.iterparse(path, ("start", "end", "attribute"), 16)]
+        self.assertEqual(events[:4], [("start", "embedded_components"), ("attribute", "id"), ("attribute", "type"),
+                                      ("start", "data")])
+        self.assertIn(("attribute", "blend_mode"), events)
+        self.assertEqual(events[-1], ("end", "embedded_components"))
+        self.assertEqual(len([e for e in events if e[0] == "start"]), len([e for e in events if e[0] == "end"]))
+
+    def test_iterparse_clear_finished_elements(self):
+        path = os.path.join(self.root_path, "nested.defold")
+        for event, element in deftree.iterparse(path):
+            parent = element.get_parent()
+            element.clear()
+            self.assertIsNone(element.get_parent())
+            self.assertEqual(len(element), 0)
+            self.assertIsNotNone(parent)
+
+    def test_iterparse_remove_finished_elements(self):
+        import io
+        import tracemalloc
+        text = document_generator.tilemap(128, 128, 1).encode("utf-8")
+        tracemalloc.start()
+        try:
+            for event, element in deftree.iterparse(io.BytesIO(text)):
+                element.get_parent().remove(element)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        # The memory is set by the chunks that are read, not by the size of the document
+        self.assertLess(peak, len(text) / 3)
+
+    def test_iterparse_invalid_document(self):
+        with self.assertRaises(deftree.ParseError):
+            list(deftree.iterparse(os.path.join(self.root_path, "not_a_valid.defold")))
+        with self.assertRaises(deftree.ParseError):
+            list(deftree.iterparse(os.path.join(self.root_path, "not_a_valid_text.defold")))
+        with self.assertRaises(ValueError):
+            list(deftree.iterparse(os.path.join(self.root_path, "simple.defold"), ("comment",)))
+
+
+class TestDefTreeFind(unittest.TestCase):
+    root_path = os.path.join(os.path.dirname(__file__), "data")
+    string_doc = """nodes {\n  id: "box"\n  type: TYPE_BOX\n  position {\n    x: 1.0\n  }\n  texture: "atlas/a"\n}
+nodes {\n  id: "btn"\n  type: TYPE_TEXT\n  position {\n    x: 2.0\n  }\n  child {\n    texture: "atlas/b"\n  }\n}\n"""
+
+    def test_find_children(self):
+        root = deftree.from_string(self.string_doc).get_root()
+        nodes = list(root.elements("nodes"))
+        self.assertEqual(root.findall("nodes"), nodes)
+        self.assertIs(root.find("nodes"), nodes[0])
+        self.assertIs(root.find('nodes[id="btn"]'), nodes[1])
+        self.assertIs(root.find("nodes[id='btn']/position/x"), nodes[1].get_element("position").get_attribute("x"))
+        self.assertIs(root.find("nodes[type=TYPE_BOX]"), nodes[0])
+        self.assertEqual(root.findall("nodes[child]"), [nodes[1]])
+        self.assertEqual(root.findall("*/id"), [nodes[0].get_attribute("id"), nodes[1].get_attribute("id")])
+        self.assertEqual(root.findall("nodes/position/.."), nodes)
+        self.assertIsNone(root.find('nodes[id="missing"]'))
+        self.assertEqual(root.findall("nodes/id/x"), [])
+
+    def test_find_by_value_before_and_after_reading_it(self):
+        text = 'nodes {\n  x: 1.50\n  id: "a"\n  visible: true\n}\nnodes {\n  x: 2\n  id: "b"\n}\n'
+        # Values are compared as the type of the attribute, 2.0 is not an int
+        paths = ["nodes[x=1.5]", "nodes[x=1.50]", "nodes[x=1.500]", "nodes[x=2]", "nodes[x=2.0]", 'nodes[x="1.5"]',
+                 "nodes[id=a]", 'nodes[id="a"]', "nodes[visible=true]", "nodes[visible=false]"]
+        expected = [0, 0, 0, 1, None, None, 0, 0, 0, None]
+        for read in [False, True]:
+            root = deftree.from_string(text).get_root()
+            nodes = list(root.elements("nodes"))
+            if read:
+                for attribute in root.iter_attributes():
+                    attribute.value
+                self.assertEqual(deftree.to_string(root).count("x: 1.5\n"), 1)
+            self.assertEqual([root.find(path) for path in paths],
+                             [None if position is None else nodes[position] for position in expected])
+
+    def test_find_descendants(self):
+        root = deftree.from_string(self.string_doc).get_root()
+        self.assertEqual([texture.value for texture in root.iterfind("//texture")], ["atlas/a", "atlas/b"])
+        self.assertEqual([texture.value for texture in root.iterfind('nodes[id="btn"]//texture')], ["atlas/b"])
+        self.assertEqual(len(root.findall("//nodes//x")), 2)
+        self.assertEqual(len(root.findall("//*")), len(list(root.iter())))
+
+    def test_find_in_embedded_data(self):
+        root = deftree.parse(os.path.join(self.root_path, "nested.defold")).get_root()
+        material = root.find("embedded_instances/data//material")
+        self.assertEqual(material.value, "/builtins/materials/sprite.material")
+        self.assertEqual(root.find('embedded_instances[id="go"]/data/embedded_components/id').value, "sprite")
+
+    def test_invalid_path(self):
+        root = deftree.DefTree().get_root()
+        for path in ["", "/nodes", "nodes/", "nodes//", "[id]", "nodes[id=]", "nodes id", "//.."]:
+            with self.assertRaises(ValueError):
+                root.find(path)
+
+
+class TestDefTreeDeferredAttributes(unittest.TestCase):
+    string_doc = 'x: 1.5\ny: -4\nid: "sprite"\nblend_mode: BLEND_MODE_ALPHA\nvisible: true\nz: 4.1751063E-15\n'
+
+    def test_parsed_attributes_are_deferred(self):
+        root = deftree.from_string(self.string_doc).get_root()
+        self.assertEqual(deftree.to_string(root), self.string_doc)
+        self.assertTrue(all(type(attribute) is deftree._DeferredAttribute for attribute in root))
+        self.assertTrue(all(deftree.is_attribute(attribute) for attribute in root))
+        self.assertTrue(all(type(attribute) is deftree._DeferredAttribute for attribute in root))
+
+    def test_deferred_attribute_types(self):
+        root = deftree.from_string(self.string_doc).get_root()
+        x, y, attribute_id, blend_mode, visible, z = root
+        self.assertIsInstance(x, deftree.DefTreeFloat)
+        self.assertIs(type(x), deftree.DefTreeFloat)
+        self.assertEqual(y.value, -4)
+        self.assertIs(type(y), deftree.DefTreeInt)
+        self.assertTrue(attribute_id.startswith("spr"))
+        self.assertIs(type(attribute_id), deftree.DefTreeString)
+        self.assertTrue(blend_mode == "BLEND_MODE_ALPHA")
+        self.assertIs(type(blend_mode), deftree.DefTreeEnum)
+        self.assertEqual(repr(visible), "DefTreeBool('visible', True)")
+        self.assertTrue(z < 1)
+        self.assertIs(type(z), deftree.DefTreeFloat)
+        self.assertEqual(deftree.to_string(root), self.string_doc)
+
+    def test_deferred_attribute_assignment(self):
+        root = deftree.from_string(self.string_doc).get_root()
+        x, y = root[0], root[1]
+        x.value = 2
+        self.assertEqual(x.value, 2.0)
+        self.assertIs(type(x), deftree.DefTreeFloat)
+        with self.assertRaises(ValueError):
+            y.value = "sprite"
+        y += 1
+        self.assertEqual(y.value, -3)
+
+    def test_resolving_keeps_attribute_in_parent(self):
+        root = deftree.from_string(self.string_doc).get_root()
+        parents = []
+        changed = deftree.Attribute._changed
+        deftree.Attribute._changed = lambda attribute: parents.append(attribute.get_parent())
+        try:
+            for attribute in root:
+                attribute.value
+        finally:
+            deftree.Attribute._changed = changed
+        self.assertEqual(parents, [])
+        self.assertTrue(all(attribute.get_parent() is root for attribute in root))
+
+
+class TestDefTreeIndex(unittest.TestCase):
+    root_path = os.path.join(os.path.dirname(__file__), "data")
+    string_doc = TestDefTreeFind.string_doc
+
+    def test_lookup(self):
+        tree = deftree.from_string(self.string_doc)
+        root = tree.get_root()
+        without_index = [tree.lookup("nodes"), tree.lookup("id", "btn"), tree.lookup("x", 2.0), tree.lookup("texture")]
+        tree.build_index()
+        self.assertEqual(tree.lookup("nodes"), list(root.elements("nodes")))
+        self.assertEqual(tree.lookup("id", "btn"), [root.find('nodes[id="btn"]/id')])
+        self.assertEqual(tree.lookup("x", 2.0), [root.find('nodes[id="btn"]/position/x')])
+        self.assertEqual(tree.lookup("type", "TYPE_TEXT"), [root.find('nodes[id="btn"]/type')])
+        self.assertEqual(len(tree.lookup("texture")), 2)
+        self.assertEqual(tree.lookup("missing"), [])
+        for expected, nodes in zip(without_index, [tree.lookup("nodes"), tree.lookup("id", "btn"),
+                                                   tree.lookup("x", 2.0), tree.lookup("texture")]):
+            self.assertCountEqual(expected, nodes)
+
+    def test_index_follows_changes(self):
+        tree = deftree.from_string(self.string_doc)
+        root = tree.get_root()
+        tree.build_index()
+        box, btn = root.elements("nodes")
+        btn.get_attribute("id").value = "button"
+        self.assertEqual(tree.lookup("id", "btn"), [])
+        self.assertEqual(tree.lookup("id", "button"), [btn.get_attribute("id")])
+
+        new = root.add_element("nodes")
+        new_id = new.add_attribute("id", "btn")
+        self.assertEqual(tree.lookup("id", "btn"), [new_id])
+        position = btn.get_element("position")
+        position.name = "scale"
+        self.assertEqual(tree.lookup("scale"), [position])
+        self.assertEqual(tree.lookup("position"), [box.get_element("position")])
+
+        root.remove(btn)
+        self.assertEqual(tree.lookup("id", "button"), [])
+        self.assertEqual(tree.lookup("scale"), [])
+        self.assertEqual(tree.lookup("texture", "atlas/b"), [])
+        root.insert(0, btn)
+        self.assertEqual(tree.lookup("texture", "atlas/b"), [btn.get_element("child").get_attribute("texture")])
+        root[0] = deftree.Element("nodes")
+        self.assertEqual(tree.lookup("texture", "atlas/b"), [])
+        self.assertEqual(len(tree.lookup("nodes")), 3)
+
+        copy = new.copy()
+        copy.get_attribute("id").value = "copy"
+        self.assertEqual(tree.lookup("id", "copy"), [])
+
+        tree.drop_index()
+        btn.get_attribute("id").value = "again"
+        root.append(btn)
+        self.assertEqual(tree.lookup("id", "again"), [btn.get_attribute("id")])
+
+    def test_index_embedded_data(self):
+        tree = deftree.parse(os.path.join(self.root_path, "nested.defold"))
+        root = tree.get_root()
+        tree.build_index()
+        self.assertEqual(tree.lookup("material"), [])
+        material = root.find("embedded_instances/data//material")
+        self.assertEqual(tree.lookup("material", "/builtins/materials/sprite.material"), [material])
+        material.value = "/main/my.material"
+        self.assertEqual(tree.lookup("material", "/main/my.material"), [material])
+
+
 class PublicAPITests(unittest.TestCase):
     """Ensures that the correct values are exposed in the public API."""
 
     def test_module_all_attribute(self):
         self.assertTrue(hasattr(deftree, '__all__'))
-        target_api = ["DefTree", "to_string", "parse", "dump", "validate", "is_element", "is_attribute", "from_string"]
+        target_api = ["DefTree", "ParseCache", "Difference", "to_string", "to_stream", "parse", "parse_many",
+                      "iterparse", "dump", "validate", "compare", "compare_many", "stats", "Stats", "is_element",
+                      "is_attribute", "from_string"]
         self.assertEqual(set(deftree.__all__), set(target_api))
 
 
@@ -13,22 +13,23 @@ def validate_project(project):
 
     acceptable_formats.extend(["defold"])
     print("Starting Validation of project")
+    defold_files = []
     for path_root, folders, files in os.walk(project):
         for f in files:
             if "{0}build{0}".format(os.sep) not in path_root and os.path.splitext(f)[-1][1:] in acceptable_formats:
-                print("Validating", f)
-                defold_file = os.path.join(path_root, f)
-                try:
-                    tree = deftree.parse(defold_file)
-                    root = tree.get_root()
-                except deftree.ParseError:
-                    print("  Couldn't parse: ", f)
-                    continue
-                if not deftree.validate(deftree.to_string(root), defold_file):
-                    print("  Error in: {}".format(defold_file))
+                defold_files.append(os.path.join(path_root, f))
+
+    for defold_file, difference in deftree.compare_many(defold_files):
+        print("Validating", os.path.basename(defold_file))
+        if isinstance(difference, Exception):
+            print("  Couldn't parse: ", defold_file)
+        elif difference is not None:
+            print("  Error in: {} at line {}, column {} ({})".format(defold_file, difference.line, difference.column,
+                                                                     difference.path))
 
     print("Validation of project ended")
 
 
-validate_project(root_path)
+if __name__ == '__main__':
+    validate_project(root_path)
 